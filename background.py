@@ -0,0 +1,55 @@
+import io
+import os
+import hashlib
+
+CACHE_DIR = ".bgcache"
+DEFAULT_DPI = 150
+
+
+# Resample a background image to `dpi` at the printed page size and optionally
+# re-encode it as JPEG, so every certificate embeds only the pixels it needs.
+# Results are cached under `cache_dir` by source content and settings; when the
+# optimised image would not be smaller the cache holds the original bytes.
+def optimize_background(path, page_size, dpi=DEFAULT_DPI, jpeg_quality=None, cache_dir=CACHE_DIR):
+    with open(path, 'rb') as f:
+        data = f.read()
+    key = hashlib.sha256(data + f"\0{page_size[0]:.2f}x{page_size[1]:.2f}@{dpi}q{jpeg_quality}".encode()).hexdigest()
+    ext = os.path.splitext(path)[1].lower() if not jpeg_quality else '.jpg'
+    cached = os.path.join(cache_dir, key + ext)
+    if os.path.exists(cached):
+        return cached
+
+    from PIL import Image
+    source = Image.open(io.BytesIO(data))
+    im = source
+    # The background is stretched over the whole page, so the page size at the target DPI is all it needs
+    width, height = (max(1, round(v / 72 * dpi)) for v in page_size)
+    if im.width > width or im.height > height:
+        # Area averaging keeps flat regions flat, which the PDF's lossless
+        # compression depends on; sharper filters add ringing that costs bytes
+        im = im.resize((min(im.width, width), min(im.height, height)), Image.BOX)
+
+    out = io.BytesIO()
+    if jpeg_quality:
+        if im.mode in ('RGBA', 'LA', 'P'):
+            im = im.convert('RGBA')
+            flat = Image.new('RGB', im.size, (255, 255, 255))
+            flat.paste(im, mask=im.getchannel('A'))
+            im = flat
+        elif im.mode != 'RGB':
+            im = im.convert('RGB')
+        im.save(out, 'JPEG', quality=jpeg_quality, optimize=True)
+    else:
+        im.save(out, source.format, optimize=True)
+    optimized = out.getvalue()
+    # Re-encoding alone can make an image bigger; keep the original bytes then
+    if not jpeg_quality and im.size == source.size and len(optimized) >= len(data):
+        optimized = data
+
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write then rename, so concurrent runs never see a half-written file
+    tmp = f"{cached}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(optimized)
+    os.replace(tmp, cached)
+    return cached
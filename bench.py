@@ -0,0 +1,386 @@
+import os
+import io
+import sys
+import json
+import time
+import random
+import platform
+import tempfile
+import threading
+import contextlib
+import subprocess
+import http.client
+import socket
+import socketserver
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+import click
+import certigen
+from rows import Row
+from mailer import Mailer
+from gitinfo import git_commit
+from metrics import percentile
+from signing import SigningSession
+from certigo import CertificateTemplate, create_certificate, digitally_sign, deliver_email
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+STAGES = ('render', 'sign', 'email')
+BENCH_PASSWORD = "bench-password"
+# Minimum time spent timing raw key operations for the sign stage
+RAW_SIGN_SECONDS = 1.0
+FIRST_NAMES = ["Asha", "Ben", "Chloé", "Dmitri", "Elif", "Farah", "Goran", "Hana", "Ivan", "Jun"]
+LAST_NAMES = ["Okafor", "Schmidt", "Nakamura", "Silva", "Kowalski", "Haddad", "Lindqvist", "Mensah", "Rossi", "Tan"]
+
+
+# Minimal SMTP server that accepts and discards everything, so delivery can be
+# measured without a real mail provider
+class StubSMTPHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.reply("220 certigo-bench ESMTP")
+        in_data = False
+        for line in self.rfile:
+            if in_data:
+                if line == b".\r\n":
+                    in_data = False
+                    self.reply("250 OK queued")
+                continue
+            command = line[:4].upper()
+            if command in (b"EHLO", b"HELO"):
+                self.reply("250 certigo-bench")
+            elif command == b"DATA":
+                in_data = True
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+            elif command == b"QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("250 OK")
+
+    def reply(self, text):
+        self.wfile.write(text.encode() + b"\r\n")
+
+
+class StubSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=0):
+        super().__init__((host, port), StubSMTPHandler)
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+        self.server_close()
+        return False
+
+
+def synthetic_rows(count, seed=0):
+    rnd = random.Random(seed)
+    for i in range(count):
+        name = f"{rnd.choice(FIRST_NAMES)} {rnd.choice(LAST_NAMES)}"
+        yield Row(name, f"B{i:06d}", f"bench{i}@example.com")
+
+
+# Throwaway signing key made the same way as the certigen wizard
+def make_bench_key(folder, key_type=certigen.DEFAULT_KEY_TYPE):
+    key_path = os.path.join(folder, f"bench_key_{key_type}.pem")
+    cert_path = os.path.join(folder, f"bench_cert_{key_type}.pem")
+    details = {
+        'common_name': 'Certigo Benchmark',
+        'email': 'bench@example.com',
+        'country': 'US',
+        'state': 'Bench',
+        'city': 'Bench',
+        'organization': 'Certigo',
+        'valid_days': 1,
+        'key_password': BENCH_PASSWORD,
+    }
+    with contextlib.redirect_stdout(io.StringIO()):
+        certigen.generate_certificate(details, key_path, cert_path, key_type)
+    return cert_path, key_path
+
+
+# Signatures per second with the key alone, outside any PDF work
+def raw_signs_per_second(key_path, key_type):
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, padding
+    with open(key_path, 'rb') as f:
+        key = serialization.load_pem_private_key(f.read(), BENCH_PASSWORD.encode())
+    digest = bytes(64)
+    hash_algorithm = certigen.CERT_HASHES[key_type]
+    if key_type == 'ed25519':
+        sign = lambda: key.sign(digest)
+    elif key_type.startswith('rsa'):
+        sign = lambda: key.sign(digest, padding.PKCS1v15(), hash_algorithm)
+    else:
+        sign = lambda: key.sign(digest, ec.ECDSA(hash_algorithm))
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < RAW_SIGN_SECONDS:
+        sign()
+        count += 1
+    return round(count / (time.perf_counter() - start), 1)
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+# Each bench sets up outside the timed region and yields a function that
+# processes one row and returns (latency in seconds, output bytes). Figures
+# that aren't per row go in opts['extra'] and are saved with the results.
+@contextlib.contextmanager
+def bench_render(work, opts):
+    template = CertificateTemplate(opts['bg_image'], opts['paper_size'], opts['orientation'])
+    path = os.path.join(work, "render.pdf")
+
+    def measure(row):
+        start = time.perf_counter()
+        create_certificate(row.name, row.cert_no, opts['bg_image'], path, opts['paper_size'], opts['orientation'],
+                           opts['layout_cfg'], template)
+        return time.perf_counter() - start, os.path.getsize(path)
+    yield measure
+
+
+@contextlib.contextmanager
+def bench_sign(work, opts):
+    cert_path, key_path = make_bench_key(work, opts['key_type'])
+    session = SigningSession(cert_path, key_path, BENCH_PASSWORD)
+    opts['extra']['raw_signs_per_second'] = raw_signs_per_second(key_path, opts['key_type'])
+    opts['extra']['bytes_reserved'] = session.bytes_reserved
+    path = os.path.join(work, "sign.pdf")
+    create_certificate("Bench Signer", "B000000", opts['bg_image'], path, opts['paper_size'], opts['orientation'],
+                       opts['layout_cfg'])
+
+    def measure(row):
+        start = time.perf_counter()
+        signed_path = digitally_sign(cert_path, key_path, BENCH_PASSWORD, path, session)
+        return time.perf_counter() - start, os.path.getsize(signed_path)
+    yield measure
+
+
+@contextlib.contextmanager
+def bench_email(work, opts):
+    path = os.path.join(work, "email.pdf")
+    create_certificate("Bench Mailer", "B000000", opts['bg_image'], path, opts['paper_size'], opts['orientation'],
+                       opts['layout_cfg'])
+    size = os.path.getsize(path)
+    with StubSMTPServer() as server:
+        host, port = server.server_address
+        with Mailer("bench@example.com", None, host=host, port=port, security='none') as mailer:
+            def measure(row):
+                start = time.perf_counter()
+                sent, status = deliver_email("bench@example.com", None, row.email, "Your Certificate",
+                                             f"Dear {row.name},\n\nCertificate Code: {row.cert_no}", path, mailer)
+                if not sent:
+                    raise RuntimeError(status)
+                return time.perf_counter() - start, size
+            yield measure
+
+
+# Starts server.py as its own process, warm and signing, and times whole HTTP
+# requests for a signed PDF from `concurrency` client connections at once
+@contextlib.contextmanager
+def bench_service(work, opts):
+    cert_path, key_path = make_bench_key(work, opts['key_type'])
+    config_path = os.path.join(work, "config.json")
+    with open(config_path, 'w') as f:
+        json.dump(opts['layout_cfg'], f)
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = subprocess.Popen([
+        sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py"),
+        "--port", str(port), "--quiet", "--output", os.path.join(work, "issued"),
+        "--bg-image", opts['bg_image'], "--config", config_path,
+        "--paper-size", opts['paper_size'], "--orientation", opts['orientation'],
+        "--sign", "--cert", cert_path, "--key", key_path, "--password", BENCH_PASSWORD,
+        "--workers", str(opts['concurrency']),
+    ], stdout=subprocess.DEVNULL)
+    local = threading.local()
+
+    def request(method, path, body=None):
+        if getattr(local, 'conn', None) is None:
+            local.conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        local.conn.request(method, path, body)
+        response = local.conn.getresponse()
+        return response.status, response.read()
+
+    try:
+        deadline = time.monotonic() + 60
+        while True:
+            try:
+                request("GET", "/health")
+                break
+            except OSError:
+                local.conn = None
+                if server.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError("server.py did not start")
+                time.sleep(0.2)
+
+        def measure(row):
+            start = time.perf_counter()
+            status, body = request("POST", "/certificate", json.dumps(row._asdict()))
+            if status != 200:
+                raise RuntimeError(f"HTTP {status}: {body[:200]!r}")
+            return time.perf_counter() - start, len(body)
+        yield measure
+    finally:
+        server.terminate()
+        server.wait()
+
+
+BENCHES = {'render': bench_render, 'sign': bench_sign, 'email': bench_email, 'service': bench_service}
+# Stages whose rows are measured from several threads at once
+CONCURRENT_STAGES = ('service',)
+
+
+# Runs in a fresh process so peak RSS belongs to this stage and size alone
+def run_stage(stage, count, opts):
+    latencies = []
+    total_bytes = 0
+    extra = {}
+    with tempfile.TemporaryDirectory(prefix="certigo-bench-") as work, \
+            BENCHES[stage](work, dict(opts, extra=extra)) as measure:
+        started = time.perf_counter()
+        if stage in CONCURRENT_STAGES and opts['concurrency'] > 1:
+            with ThreadPoolExecutor(opts['concurrency']) as executor:
+                measured = list(executor.map(measure, synthetic_rows(count)))
+        else:
+            measured = (measure(row) for row in synthetic_rows(count))
+        for latency, size in measured:
+            latencies.append(latency)
+            total_bytes += size
+        elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'stage': stage,
+        'key_type': opts['key_type'] if stage == 'sign' else None,
+        'concurrency': opts['concurrency'] if stage in CONCURRENT_STAGES else None,
+        'rows': count,
+        'seconds': round(elapsed, 3),
+        'rows_per_second': round(count / elapsed, 2) if elapsed else None,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'peak_rss_mb': peak_rss_mb(),
+        'bytes_per_cert': round(total_bytes / count) if count else 0,
+        **extra,
+    }
+
+
+def library_versions():
+    versions = {}
+    for module in ('reportlab', 'pyhanko', 'yagmail', 'cryptography'):
+        try:
+            versions[module] = __import__(module).__version__
+        except (ImportError, AttributeError):
+            versions[module] = None
+    return versions
+
+
+def print_table(results, baseline=None):
+    base = {(r['stage'], r.get('key_type'), r['rows']): r for r in baseline['results']} if baseline else {}
+    print(f"{'stage':<16}{'rows':>9}{'rows/s':>11}{'p50 ms':>10}{'p99 ms':>10}{'peak MB':>10}{'bytes/cert':>12}"
+          + ("  vs baseline" if base else ""))
+    for r in results:
+        label = f"{r['stage']} {r['key_type']}" if r.get('key_type') else r['stage']
+        if r.get('concurrency'):
+            label += f" x{r['concurrency']}"
+        line = (f"{label:<16}{r['rows']:>9}{r['rows_per_second']:>11}{r['p50_ms']:>10}{r['p99_ms']:>10}"
+                f"{str(r['peak_rss_mb']):>10}{r['bytes_per_cert']:>12}")
+        old = base.get((r['stage'], r.get('key_type'), r['rows']))
+        if old and old['rows_per_second']:
+            line += f"  {r['rows_per_second'] / old['rows_per_second']:.2f}x throughput"
+        print(line)
+
+
+# The key type comparison from the README: raw key speed, signed PDFs and signature size
+def print_signing_table(results):
+    rows = [r for r in results if 'raw_signs_per_second' in r]
+    if not rows:
+        return
+    print(f"\n{'key type':<10}{'rows':>9}{'raw signs/s':>13}{'signed PDFs/s':>15}{'reserved KB':>13}")
+    for r in rows:
+        print(f"{r['key_type']:<10}{r['rows']:>9}{r['raw_signs_per_second']:>13}{r['rows_per_second']:>15}"
+              f"{r['bytes_reserved'] / 1024:>13.1f}")
+
+
+@click.command()
+@click.option('--sizes', default='100,10000,100000', show_default=True, help='Comma-separated synthetic row counts')
+@click.option('--stages', default=','.join(STAGES), show_default=True, help=f"Comma-separated stages to time: {', '.join(BENCHES)}")
+@click.option('--key-types', default=certigen.DEFAULT_KEY_TYPE, show_default=True,
+              help=f"Comma-separated signing key types for the sign stage: {', '.join(certigen.KEY_TYPES)}")
+@click.option('--concurrency', default=4, show_default=True, help='Client connections and server worker processes for the service stage')
+@click.option('--bg-image', default='template.png', show_default=True)
+@click.option('--config', default='config.json', show_default=True)
+@click.option('--orientation', type=click.Choice(['portrait', 'landscape']), default='landscape')
+@click.option('--paper-size', type=click.Choice(['A4', 'LETTER']), default='A4')
+@click.option('--output', help='Where to save the JSON results. Defaults to bench_results/<time>-<commit>.json')
+@click.option('--compare', type=click.Path(exists=True), help='Earlier results JSON to compare throughput against')
+def main(sizes, stages, key_types, concurrency, bg_image, config, orientation, paper_size, output, compare):
+    sizes = [int(s) for s in sizes.split(',') if s.strip()]
+    stages = [s.strip() for s in stages.split(',') if s.strip()]
+    for stage in stages:
+        if stage not in BENCHES:
+            raise click.BadParameter(f"unknown stage '{stage}'", param_hint='--stages')
+    key_types = [k.strip() for k in key_types.split(',') if k.strip()]
+    for key_type in key_types:
+        if key_type not in certigen.KEY_TYPES:
+            raise click.BadParameter(f"unknown key type '{key_type}'", param_hint='--key-types')
+
+    opts = {
+        'bg_image': bg_image,
+        'paper_size': paper_size,
+        'orientation': orientation,
+        'concurrency': concurrency,
+        'layout_cfg': json.load(open(config)),
+    }
+
+    results = []
+    ctx = multiprocessing.get_context('spawn')
+    for stage in stages:
+        for key_type in key_types if stage == 'sign' else key_types[:1]:
+            for count in sizes:
+                print(f"⏱ {stage}{' ' + key_type if stage == 'sign' else ''} × {count} ...", flush=True)
+                with ctx.Pool(1) as pool:
+                    results.append(pool.apply(run_stage, (stage, count, dict(opts, key_type=key_type))))
+
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'versions': library_versions(),
+        'options': {k: v for k, v in opts.items() if k != 'layout_cfg'},
+        'results': results,
+    }
+
+    if not output:
+        os.makedirs("bench_results", exist_ok=True)
+        output = os.path.join("bench_results", f"{time.strftime('%Y%m%d-%H%M%S')}-{commit or 'nogit'}.json")
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print()
+    print_table(results, json.load(open(compare)) if compare else None)
+    print_signing_table(results)
+    print(f"\nResults saved to {output}")
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    main()
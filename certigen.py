@@ -1,6 +1,24 @@
-from OpenSSL import crypto
+import click
 import getpass
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+
+# Key types and the hash each self-signs its certificate with. RSA signing gets
+# markedly slower with key size; ECDSA and Ed25519 are much faster for bulk
+# signing and give far smaller signatures.
+CERT_HASHES = {
+    'rsa2048': hashes.SHA512(),
+    'rsa3072': hashes.SHA512(),
+    'rsa4096': hashes.SHA512(),
+    'p256': hashes.SHA256(),
+    'p384': hashes.SHA384(),
+    'ed25519': None,
+}
+KEY_TYPES = tuple(CERT_HASHES)
+DEFAULT_KEY_TYPE = 'rsa4096'
 
 def get_user_details():
     print("\n" + "="*50)
@@ -16,8 +34,13 @@ def get_user_details():
         'organization': input("6. Organization: ").strip(),
         'valid_days': int(input("7. Validity period (days, default 365): ") or 365),
         'key_password': getpass.getpass("8. Enter password for private key: "),
-        'key_password_confirm': getpass.getpass("   Confirm password: ")
+        'key_password_confirm': getpass.getpass("   Confirm password: "),
+        'key_type': input(f"9. Key type ({'/'.join(KEY_TYPES)}, default {DEFAULT_KEY_TYPE}): ").strip().lower() or DEFAULT_KEY_TYPE
     }
+
+    while details['key_type'] not in KEY_TYPES:
+        print(f"\nUnknown key type! Choose one of {', '.join(KEY_TYPES)}.")
+        details['key_type'] = input("Key type: ").strip().lower() or DEFAULT_KEY_TYPE
     
     while details['key_password'] != details['key_password_confirm']:
         print("\nPasswords don't match! Please try again.")
@@ -26,57 +49,104 @@ def get_user_details():
     
     return details
 
-def generate_certificate(user_details):
+def generate_private_key(key_type):
+    if key_type not in KEY_TYPES:
+        raise ValueError(f"Unknown key type '{key_type}', expected one of {', '.join(KEY_TYPES)}")
+    if key_type.startswith('rsa'):
+        return rsa.generate_private_key(public_exponent=65537, key_size=int(key_type[3:]))
+    if key_type == 'ed25519':
+        return ed25519.Ed25519PrivateKey.generate()
+    return ec.generate_private_key(ec.SECP256R1() if key_type == 'p256' else ec.SECP384R1())
+
+def generate_certificate(user_details, key_path="key.pem", cert_path="cert.pem", key_type=DEFAULT_KEY_TYPE):
     # Generate key pair
-    key = crypto.PKey()
-    key.generate_key(crypto.TYPE_RSA, 4096)
-    
-    # Create certificate
-    cert = crypto.X509()
-    
+    key = generate_private_key(key_type)
+
     # Set certificate details
-    cert.get_subject().CN = user_details['common_name']
-    cert.get_subject().emailAddress = user_details['email']
-    cert.get_subject().C = user_details['country']
-    cert.get_subject().ST = user_details['state']
-    cert.get_subject().L = user_details['city']
-    cert.get_subject().O = user_details['organization']
-    
-    # Set validity period
-    cert.set_serial_number(int(datetime.now().timestamp()))
-    cert.gmtime_adj_notBefore(0)
-    cert.gmtime_adj_notAfter(user_details['valid_days'] * 24 * 60 * 60)
-    
-    # Self-sign
-    cert.set_issuer(cert.get_subject())
-    cert.set_pubkey(key)
-    cert.sign(key, 'sha512')
-    
+    subject = x509.Name([
+        x509.NameAttribute(oid, user_details[field])
+        for oid, field in (
+            (NameOID.COMMON_NAME, 'common_name'),
+            (NameOID.EMAIL_ADDRESS, 'email'),
+            (NameOID.COUNTRY_NAME, 'country'),
+            (NameOID.STATE_OR_PROVINCE_NAME, 'state'),
+            (NameOID.LOCALITY_NAME, 'city'),
+            (NameOID.ORGANIZATION_NAME, 'organization'),
+        )
+        if user_details.get(field)
+    ])
+
+    # Set validity period and self-sign
+    now = datetime.now(timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(subject)
+        .issuer_name(subject)
+        .public_key(key.public_key())
+        .serial_number(int(now.timestamp()))
+        .not_valid_before(now)
+        .not_valid_after(now + timedelta(days=user_details['valid_days']))
+        .sign(key, CERT_HASHES[key_type])
+    )
+
     # Save password-protected private key
-    with open("key.pem", "wb") as f:
-        f.write(crypto.dump_privatekey(
-            crypto.FILETYPE_PEM,
-            key,
-            cipher='aes256',
-            passphrase=user_details['key_password'].encode()
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.BestAvailableEncryption(user_details['key_password'].encode())
         ))
-    
+
     # Save certificate
-    with open("cert.pem", "wb") as f:
-        f.write(crypto.dump_certificate(crypto.FILETYPE_PEM, cert))
-    
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+
     print("\n" + "="*50)
     print("Certificate Generation Complete!")
     print("="*50)
     print(f"\nFiles created:")
-    print(f"- Private Key: key.pem (password protected)")
-    print(f"- Certificate: cert.pem")
+    print(f"- Private Key: {key_path} ({key_type}, password protected)")
+    print(f"- Certificate: {cert_path}")
     print("\nKeep these files secure, especially the private key!")
 
-if __name__ == "__main__":
+# Runs the wizard, or with --non-interactive takes every detail from the options
+@click.command()
+@click.option('--non-interactive', is_flag=True, help='Take the details from the options below instead of asking')
+@click.option('--common-name', help='Common Name (your name/company)')
+@click.option('--email', default='', help='Email address')
+@click.option('--country', default='', help='Country Code (2 letters)')
+@click.option('--state', default='', help='State/Province')
+@click.option('--city', default='', help='City/Locality')
+@click.option('--organization', default='', help='Organization')
+@click.option('--valid-days', default=365, show_default=True, help='Validity period in days')
+@click.option('--password', envvar='CERTIGEN_KEY_PASSWORD', help='Password for the private key. Also read from CERTIGEN_KEY_PASSWORD.')
+@click.option('--key-type', type=click.Choice(KEY_TYPES), default=DEFAULT_KEY_TYPE, show_default=True)
+@click.option('--key', 'key_path', default='key.pem', show_default=True)
+@click.option('--cert', 'cert_path', default='cert.pem', show_default=True)
+def main(non_interactive, common_name, email, country, state, city, organization, valid_days, password, key_type,
+         key_path, cert_path):
     try:
-        user_details = get_user_details()
-        generate_certificate(user_details)
+        if non_interactive:
+            if not common_name or not password:
+                raise click.UsageError("--non-interactive needs --common-name and --password")
+            user_details = {
+                'common_name': common_name,
+                'email': email,
+                'country': country.upper(),
+                'state': state,
+                'city': city,
+                'organization': organization,
+                'valid_days': valid_days,
+                'key_password': password,
+            }
+        else:
+            user_details = get_user_details()
+            key_type = user_details['key_type']
+        generate_certificate(user_details, key_path, cert_path, key_type)
+    except click.UsageError:
+        raise
     except Exception as e:
-        print(f"\nError: {e}")
-        print("Certificate generation failed.")
\ No newline at end of file
+        raise click.ClickException(f"Certificate generation failed: {e}")
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,143 @@
+import io
 import os
+import copy
+import hashlib
+import threading
+import multiprocessing
 import click
-import pandas as pd
 import json
-from pyhanko.sign import signers, sign_pdf
-from pyhanko.pdf_utils.incremental_writer import IncrementalPdfFileWriter
+from collections import namedtuple
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4, LETTER, landscape, portrait
 from reportlab.lib.utils import ImageReader
-import yagmail
+from reportlab.pdfbase.pdfdoc import PDFImageXObject
+from mailer import Mailer, SMTP_HOST, SMTP_PORT, SMTP_SECURITY, SMTP_TIMEOUT, RECONNECT_ERRORS
+from pipeline import pipelined
+from rows import iter_rows, count_rows
+from journal import Journal
+from registry import Registry
+from mergedpdf import MergedPdfWriter
+from background import optimize_background, CACHE_DIR, DEFAULT_DPI
+from metrics import Metrics, timed
+from fonts import font_name, register_fonts, fonts_digest
+from outbox import Outbox, Delivery, OUTBOX_FOLDER, MAX_ATTEMPTS, LINGER, build_message
+from output import LAYOUTS, DEFAULT_SHARD_DIGITS, ARCHIVE_TYPES, ArchiveWriter, shard_folder, is_archive
 
 CERT_FOLDER = "certificates"
+JOURNAL_FILE = ".journal.db"
+METRICS_FILE = ".metrics.jsonl"
+REGISTRY_FILE = "registry.db"
+MERGED_FILE = "certificates.pdf"
+ARCHIVE_FILE = "certificates.zip"
 PAPER_SIZES = {'A4': A4, 'LETTER': LETTER}
+# Bump when rendering changes in a way that should invalidate incremental builds
+FINGERPRINT_VERSION = "1"
 
-# Draw certificate
-def create_certificate(name, cert_no, bg_image_path, output_path, paper_size, orientation, layout_cfg):
+def is_pdf(path):
+    return path.lower().endswith('.pdf')
+
+def page_size_for(paper_size, orientation):
     size = PAPER_SIZES.get(paper_size.upper(), A4)
-    page_size = landscape(size) if orientation == 'landscape' else portrait(size)
-    width, height = page_size
-    c = canvas.Canvas(output_path, pagesize=page_size)
+    return landscape(size) if orientation == 'landscape' else portrait(size)
+
+# Background template, decoded and encoded once and stamped under every certificate
+class CertificateTemplate:
+    def __init__(self, bg_image_path, paper_size, orientation, reproducible=False):
+        self.page_size = page_size_for(paper_size, orientation)
+        self.bg_image_path = bg_image_path
+        # Reproducible output leaves out creation dates and random document IDs,
+        # so the same inputs always give byte-identical PDFs.
+        self.reproducible = reproducible
+        self.digest = ''
+        self._xobject = None
+        self._form = None
+
+        if os.path.exists(bg_image_path):
+            with open(bg_image_path, 'rb') as f:
+                self.digest = hashlib.sha256(f.read()).hexdigest()
+            if is_pdf(bg_image_path):
+                # Vector templates are imported once and stamped as a form XObject
+                from pdftemplate import PdfForm
+                self._form = PdfForm(bg_image_path)
+            else:
+                # The image name only has to be unique inside each PDF, so the content
+                # digest reportlab would compute per document is not needed here.
+                self._xobject = PDFImageXObject('CertigoBackground', ImageReader(bg_image_path))
+
+    def draw_background(self, c):
+        if self._form is not None:
+            self.draw_form(c)
+            return
+        if self._xobject is None:
+            return
+        width, height = self.page_size
+        name = self._xobject.name
+        reg_name = c._doc.getXObjectName(name)
+        if reg_name not in c._doc.idToObject:
+            # Register a shallow copy so the pre-compressed stream is shared
+            # while each document gets its own object reference.
+            xobj = copy.copy(self._xobject)
+            c._setXObjects(xobj)
+            c._doc.Reference(xobj, reg_name)
+            c._doc.addForm(name, xobj)
+        c._currentPageHasImages = 1
+        c.saveState()
+        c.scale(width, height)
+        c._code.append("/%s Do" % reg_name)
+        c.restoreState()
+        c._formsinuse.append(name)
+
+    def draw_form(self, c):
+        from pdftemplate import ImportedObject, imported_name
+        name = 'CertigoBackground'
+        reg_name = c._doc.getXObjectName(name)
+        if reg_name not in c._doc.idToObject:
+            for i in range(len(self._form)):
+                c._doc.Reference(ImportedObject(self._form, i, reg_name), imported_name(reg_name, i))
+        c._code.append(self._form.draw_op(reg_name, self.page_size))
+        c._formsinuse.append(name)
 
-    if os.path.exists(bg_image_path):
-        bg = ImageReader(bg_image_path)
-        c.drawImage(bg, 0, 0, width=width, height=height)
+    def draw_fields(self, c, name, cert_no, layout_cfg):
+        # Draw name
+        draw_text(c, layout_cfg['name'], name)
 
-    # Draw name
-    draw_text(c, layout_cfg['name'], name)
+        # Draw cert_no
+        draw_text(c, layout_cfg['cert_no'], "Certificate No: " + cert_no)
 
-    # Draw cert_no
-    draw_text(c, layout_cfg['cert_no'], "Certificate No: " + cert_no)
+    def render(self, name, cert_no, output_path, layout_cfg):
+        c = canvas.Canvas(output_path, pagesize=self.page_size, invariant=self.reproducible)
+        self.draw_background(c)
+        self.draw_fields(c, name, cert_no, layout_cfg)
+        c.save()
 
-    c.save()
+    def render_bytes(self, name, cert_no, layout_cfg):
+        buf = io.BytesIO()
+        self.render(name, cert_no, buf, layout_cfg)
+        return buf.getvalue()
+
+    # Just the text on a transparent page, for previews that draw the background themselves
+    def render_text_bytes(self, name, cert_no, layout_cfg):
+        buf = io.BytesIO()
+        c = canvas.Canvas(buf, pagesize=self.page_size, invariant=self.reproducible)
+        self.draw_fields(c, name, cert_no, layout_cfg)
+        c.save()
+        return buf.getvalue()
+
+# Draw certificate
+def create_certificate(name, cert_no, bg_image_path, output_path, paper_size, orientation, layout_cfg, template=None,
+                       reproducible=False):
+    if template is None:
+        template = CertificateTemplate(bg_image_path, paper_size, orientation, reproducible)
+    template.render(name, cert_no, output_path, layout_cfg)
+
+def create_certificate_bytes(name, cert_no, bg_image_path, paper_size, orientation, layout_cfg, template=None,
+                             reproducible=False):
+    if template is None:
+        template = CertificateTemplate(bg_image_path, paper_size, orientation, reproducible)
+    return template.render_bytes(name, cert_no, layout_cfg)
 
 def draw_text(c, cfg, text):
-    c.setFont(cfg['font'], cfg['size'])
+    c.setFont(font_name(cfg['font']), cfg['size'])
     c.setFillColorRGB(*(v / 255 for v in cfg['color']))
     align = cfg.get('align', 'left')
     x, y = cfg['x'], cfg['y']
@@ -41,80 +146,433 @@ def draw_text(c, cfg, text):
     else:
         c.drawString(x, y, text)
 
-# Sign PDF
-def digitally_sign(cert_path, key_path, password, pdf_path):
-    signer = signers.SimpleSigner.load(
-        cert_file=cert_path,
-        key_file=key_path,
-        key_passphrase=password.encode()
-    )
-    with open(pdf_path, 'rb') as inf:
-        w = IncrementalPdfFileWriter(inf)
-        out = sign_pdf(
-            w,
-            signature_meta=signers.PdfSignatureMetadata(field_name="Signature1"),
-            signer=signer,
-            existing_fields_only=False
-        )
-        signed_path = pdf_path.replace(".pdf", "_signed.pdf")
-        with open(signed_path, 'wb') as outf:
-            outf.write(out.getbuffer())
-        return signed_path
+def signed_filename(pdf_path):
+    return pdf_path.replace(".pdf", "_signed.pdf")
+
+# Sign PDF. pyHanko is slow to import, so the signing module is only loaded
+# once something is actually signed.
+def digitally_sign(cert_path, key_path, password, pdf_path, session=None):
+    if session is None:
+        from signing import SigningSession
+        session = SigningSession(cert_path, key_path, password)
+    return session.sign_to_path(pdf_path, signed_filename(pdf_path))
+
+def digitally_sign_bytes(cert_path, key_path, password, pdf_bytes, session=None):
+    if session is None:
+        from signing import SigningSession
+        session = SigningSession(cert_path, key_path, password)
+    return session.sign_bytes(pdf_bytes)
+
+def signing_session(sign_args):
+    if not sign_args:
+        return None
+    from signing import SigningSession
+    return SigningSession(*sign_args)
 
 # Send email
-def send_email(sender_email, app_password, to_email, subject, body, attachment):
+def deliver_email(sender_email, app_password, to_email, subject, body, attachment, mailer=None, metrics=None,
+                  cert_no=None):
+    events = []
     try:
-        yag = yagmail.SMTP(
-            user=sender_email, 
-            password=app_password,
-            host="smtp.gmail.com",
-            port=587,
-            smtp_starttls=True,
-            smtp_ssl=False
-        )
-        yag.send(to=to_email, subject=subject, contents=body, attachments=attachment)
-        print(f"📧 Email sent to {to_email}")
+        with timed(events, 'email', cert_no) as event:
+            if mailer is None:
+                with Mailer(sender_email, app_password) as mailer:
+                    event['retries'] = mailer.send(to=to_email, subject=subject, contents=body, attachments=attachment)
+            else:
+                event['retries'] = mailer.send(to=to_email, subject=subject, contents=body, attachments=attachment)
+            event['bytes'] = os.path.getsize(attachment) if attachment else 0
+        return True, f"📧 Email sent to {to_email}"
     except Exception as e:
-        print(f"❌ Failed to send email to {to_email}: {e}")
+        if isinstance(e, RECONNECT_ERRORS) and events:
+            events[-1]['retries'] = mailer.retries
+        return False, f"❌ Failed to send email to {to_email}: {e}"
+    finally:
+        if metrics is not None:
+            metrics.extend(events)
+
+def send_email(sender_email, app_password, to_email, subject, body, attachment, mailer=None):
+    print(deliver_email(sender_email, app_password, to_email, subject, body, attachment, mailer)[1])
+
+def certificate_email_body(name, cert_no):
+    return f"Dear {name},\n\nPlease find your certificate attached.\n\nCertificate Code: {cert_no}\n\nRegards,\nTeam"
+
+# Batch helpers
+def certificate_filename(name, cert_no):
+    return f"{name.replace(' ', '_')}_{cert_no}.pdf"
+
+# Fingerprint of everything besides the row that shapes a certificate: layout,
+# fonts, background, page size and signing identity
+def batch_fingerprint(template, layout_cfg, signing=None):
+    h = hashlib.sha256()
+    # Left out for built-in fonts, so existing fingerprints stay valid
+    fonts = fonts_digest(layout_cfg)
+    if fonts:
+        h.update(fonts.encode())
+        h.update(b'\0')
+    for part in (
+        FINGERPRINT_VERSION,
+        json.dumps(layout_cfg, sort_keys=True),
+        template.digest,
+        repr(template.page_size),
+        signing.fingerprint if signing else '',
+        signing.signature_meta.field_name if signing else '',
+    ):
+        h.update(part.encode())
+        h.update(b'\0')
+    return h.hexdigest()
+
+def row_fingerprint(batch_fp, name, cert_no):
+    return hashlib.sha256(f"{batch_fp}\0{name}\0{cert_no}".encode()).hexdigest()
+
+# The row with its output path, why it was skipped, the timing events of the
+# stages that ran and the SHA-256 of the file written. skipped is None when it
+# was rendered, 'resumed' when the journal already had it, 'up-to-date' when an
+# incremental build found its inputs unchanged. When rendering for an archive
+# nothing is written: path is the name inside the archive and data the PDF.
+RowResult = namedtuple('RowResult', ('name', 'cert_no', 'email', 'path', 'skipped', 'events', 'sha256', 'data'))
+
+def render_row(row, template, layout_cfg, output_folder, signing=None, journal=None, resume=False, fingerprint=None,
+               layout='flat', shard_digits=DEFAULT_SHARD_DIGITS, archive=False):
+    name, cert_no, to_email = row
+    filename = certificate_filename(name, cert_no)
+    if signing:
+        filename = signed_filename(filename)
+    relative_path = os.path.join(shard_folder(cert_no, layout, shard_digits), filename)
+    final_path = relative_path if archive else os.path.join(output_folder, relative_path)
+
+    if resume and journal.has(cert_no, 'signed' if signing else 'rendered') and os.path.exists(final_path):
+        return RowResult(name, cert_no, to_email, final_path, 'resumed', [], None, None)
+
+    row_fp = row_fingerprint(fingerprint, name, cert_no) if fingerprint else None
+    if row_fp and journal.output_fingerprint(final_path) == row_fp and os.path.exists(final_path):
+        return RowResult(name, cert_no, to_email, final_path, 'up-to-date', [], None, None)
+
+    # Render and sign in memory so only the finished file reaches the disk
+    events = []
+    with timed(events, 'render', cert_no) as event:
+        pdf = template.render_bytes(name, cert_no, layout_cfg)
+        event['bytes'] = len(pdf)
+    if signing:
+        with timed(events, 'sign', cert_no) as event:
+            pdf = signing.sign_bytes(pdf)
+            event['bytes'] = len(pdf)
+    if archive:
+        # The caller streams it into the archive, in the order rows finish
+        return RowResult(name, cert_no, to_email, final_path, None, events, hashlib.sha256(pdf).hexdigest(), pdf)
+    with timed(events, 'write', cert_no) as event:
+        if layout != 'flat':
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        with open(final_path, 'wb') as f:
+            f.write(pdf)
+        event['bytes'] = len(pdf)
+
+    if journal is not None:
+        journal.mark(cert_no, 'rendered', final_path)
+        if signing:
+            journal.mark(cert_no, 'signed', final_path)
+        journal.record_output(final_path, row_fp)
+    return RowResult(name, cert_no, to_email, final_path, None, events, hashlib.sha256(pdf).hexdigest(), None)
+
+# Worker processes build their template, layout config, signing session and journal once, in the pool initializer
+_worker_state = {}
+
+def _init_worker(bg_image, paper_size, orientation, layout_cfg, output_folder, sign_args, journal_path, resume, incremental,
+                 layout, shard_digits, archive):
+    _worker_state['template'] = CertificateTemplate(bg_image, paper_size, orientation, reproducible=incremental)
+    register_fonts(layout_cfg)
+    _worker_state['layout_cfg'] = layout_cfg
+    _worker_state['output_folder'] = output_folder
+    _worker_state['signing'] = signing_session(sign_args)
+    _worker_state['journal'] = Journal(journal_path) if journal_path else None
+    _worker_state['resume'] = resume
+    _worker_state['fingerprint'] = batch_fingerprint(
+        _worker_state['template'], layout_cfg, _worker_state['signing']
+    ) if incremental else None
+    _worker_state['layout'] = layout
+    _worker_state['shard_digits'] = shard_digits
+    _worker_state['archive'] = archive
+
+def _render_row_in_worker(row):
+    return render_row(row, **_worker_state)
+
+# Render every row as a page of one PDF, signing the finished document once
+def write_merged(rows, template, layout_cfg, output_path, signing=None, on_row=None, metrics=None, registry=None):
+    metrics = metrics or Metrics()
+    target = output_path + ".part" if signing else output_path
+    final_path = signed_filename(output_path) if signing else output_path
+    signer = signing.fingerprint if signing else None
+    cert_nos = []
+    with MergedPdfWriter(target, template, layout_cfg) as writer:
+        for name, cert_no, to_email in rows:
+            # Pages are written as they are rendered, so render includes the write
+            with metrics.stage('render', cert_no) as event:
+                start = writer.pos
+                writer.add_page(name, cert_no)
+                event['bytes'] = writer.pos - start
+            if registry is not None:
+                registry.record(cert_no, name, to_email, final_path, None, signer)
+            cert_nos.append(cert_no)
+            if on_row:
+                on_row(name, cert_no)
+    if signing:
+        with metrics.stage('sign') as event:
+            signing.sign_to_path(target, final_path)
+            event['bytes'] = os.path.getsize(final_path)
+        os.remove(target)
+    if registry is not None:
+        registry.set_hash(cert_nos, file_sha256(final_path))
+    return len(cert_nos), final_path
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+# Shrink the background once for the whole batch. Returns the image to render
+# with and the bytes of a sample certificate before and after, or None when
+# nothing was done. The original is kept when the optimised one saves nothing.
+def prepare_background(bg_image, paper_size, orientation, layout_cfg, dpi, jpeg_quality=None, cache_dir=CACHE_DIR):
+    if not dpi or not os.path.exists(bg_image) or is_pdf(bg_image):
+        return bg_image, None
+    optimized = optimize_background(bg_image, page_size_for(paper_size, orientation), dpi, jpeg_quality, cache_dir)
+    # Sample certificate sizes are kept next to the cached image, so a cache hit
+    # doesn't encode the background twice more just to report them
+    sizes_path = optimized + ".sizes.json"
+    if os.path.exists(sizes_path):
+        with open(sizes_path) as f:
+            before, after = json.load(f)
+    else:
+        before, after = (
+            len(CertificateTemplate(path, paper_size, orientation).render_bytes("Sample Name", "SAMPLE", layout_cfg))
+            for path in (bg_image, optimized)
+        )
+        tmp = f"{sizes_path}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump([before, after], f)
+        os.replace(tmp, sizes_path)
+    if after >= before:
+        return bg_image, (before, before)
+    return optimized, (before, after)
+
+def auto_chunk_size(row_count, workers):
+    if row_count is None:
+        return 32
+    chunk_size, extra = divmod(row_count, workers * 4)
+    return max(1, chunk_size + bool(extra))
 
 # CLI
 @click.command()
-@click.option('--excel', required=True, help='Excel file with cert_no,name,email', default='data.xlsx')
-@click.option('--bg-image', required=True, help='Background PNG/JPG image', default='template.png')
+@click.option('--excel', required=True, help='Excel (.xlsx), CSV or Parquet file with cert_no,name,email', default='data.xlsx')
+@click.option('--bg-image', required=True, help='Background PNG/JPG image, or a PDF whose first page is used', default='template.png')
 @click.option('--config', required=True, help='JSON file with font/position/color settings', default='config.json')
 @click.option('--orientation', type=click.Choice(['portrait', 'landscape']), default='landscape')
 @click.option('--paper-size', type=click.Choice(['A4', 'LETTER']), default='A4')
+@click.option('--bg-dpi', default=0, show_default=True, help=f'Resample the background to this resolution at the printed page size, e.g. {DEFAULT_DPI} for certificates only shown on screen. 0 embeds it unchanged.')
+@click.option('--bg-jpeg-quality', type=click.IntRange(1, 95), help='Also re-encode the background as JPEG at this quality')
 @click.option('--sign/--no-sign', default=False)
 @click.option('--cert', default='cert.pem')
 @click.option('--key', default='key.pem')
 @click.option('--password', default='password', help='Password for the private key. If not set, Default password is password.')
+@click.option('--signature-field', default='Signature1', show_default=True, help='Name of the signature field added to each PDF')
 @click.option('--email/--no-email', default=False)
 @click.option('--sender', help='Gmail sender email')
 @click.option('--app-pass', help='Gmail app password')
-def main(excel, bg_image, config, orientation, paper_size, sign, cert, key, password, email, sender, app_pass):
-    df = pd.read_excel(excel)
+@click.option('--smtp-host', default=SMTP_HOST, show_default=True, help='SMTP server host')
+@click.option('--smtp-port', default=SMTP_PORT, show_default=True, help='SMTP server port')
+@click.option('--smtp-security', type=click.Choice(SMTP_SECURITY), default='starttls', show_default=True)
+@click.option('--smtp-timeout', default=SMTP_TIMEOUT, show_default=True, help='Seconds to wait for the SMTP server before giving up on a connection')
+@click.option('--smtp-connections', default=2, show_default=True, help='Number of SMTP connections kept open for the batch')
+@click.option('--max-per-connection', default=100, show_default=True, help='Messages sent before a connection is reopened. 0 for no limit.')
+@click.option('--send-rate', default=0.0, show_default=True, help='Maximum messages per second. 0 for no limit.')
+@click.option('--max-per-hour', default=0, show_default=True, help='Maximum messages in any rolling hour. 0 for no limit.')
+@click.option('--max-attempts', default=MAX_ATTEMPTS, show_default=True, help='Attempts per email before it is moved to the outbox dead letters')
+@click.option('--outbox', 'outbox_path', help=f'Folder emails are queued in before they are sent. Defaults to {OUTBOX_FOLDER} in the output folder.')
+@click.option('--deliver/--no-deliver', default=True, show_default=True, help='Send queued emails while the batch runs. With --no-deliver they wait in the outbox for outbox.py.')
+@click.option('--workers', default=1, show_default=True, help='Number of worker processes for rendering and signing. 0 uses every CPU core.')
+@click.option('--chunk-size', type=int, help='Rows handed to a worker at a time. Defaults to an automatic size based on the row count.')
+@click.option('--journal', 'journal_path', help='Job journal recording finished rows. Defaults to .journal.db in the output folder.')
+@click.option('--resume', is_flag=True, help='Skip rows the journal records as already rendered, signed or emailed')
+@click.option('--incremental', is_flag=True, help='Only rebuild certificates whose row, layout, background, paper or signing settings changed. Output PDFs are made byte-reproducible.')
+@click.option('--merge', is_flag=True, help=f'Write every certificate as a page of a single {MERGED_FILE} in the output folder')
+@click.option('--layout', type=click.Choice(LAYOUTS), default='flat', show_default=True, help='Folder layout of the output: all in one folder, a sub-folder per cert_no prefix, or 256 sub-folders by hash of cert_no')
+@click.option('--shard-digits', default=DEFAULT_SHARD_DIGITS, show_default=True, help='With --layout prefix, trailing cert_no characters left out of the folder name. 3 puts V25001..V25999 in V25.')
+@click.option('--archive', 'archive_path', help=f'Stream the certificates into this {"/".join(ARCHIVE_TYPES)} file instead of writing separate PDFs')
+@click.option('--queue-size', default=64, show_default=True, help='Certificates allowed to wait between the render and email stages')
+@click.option('--registry', 'registry_path', help=f'Registry of issued certificates used by verify.py. Defaults to {REGISTRY_FILE} in the output folder.')
+@click.option('--metrics-log', help=f'JSON-lines file receiving one timing record per row and stage. Defaults to {METRICS_FILE} in the output folder.')
+def main(excel, bg_image, config, orientation, paper_size, bg_dpi, bg_jpeg_quality, sign, cert, key, password, signature_field, email, sender, app_pass,
+         smtp_host, smtp_port, smtp_security, smtp_timeout, smtp_connections, max_per_connection, send_rate, max_per_hour, max_attempts, outbox_path,
+         deliver, workers, chunk_size, journal_path, resume, incremental, merge,
+         layout, shard_digits, archive_path, queue_size, registry_path, metrics_log):
+    if merge and (email or resume or incremental or archive_path):
+        raise click.UsageError("--merge writes one combined PDF and can't be used with --email, --resume, --incremental or --archive")
+    if archive_path and (email or resume or incremental):
+        raise click.UsageError("--archive writes no separate PDFs and can't be used with --email, --resume or --incremental")
+    if email and not sender:
+        raise click.UsageError("--email needs a --sender address")
+    if archive_path and not is_archive(archive_path):
+        raise click.BadParameter(f"use one of {', '.join(ARCHIVE_TYPES)}", param_hint='--archive')
+
+    try:
+        rows = iter_rows(excel)
+    except ImportError as e:
+        raise click.ClickException(str(e))
     layout_cfg = json.load(open(config))
+    try:
+        # Parsed here so forked workers inherit the fonts, and a bad font fails before any row
+        register_fonts(layout_cfg)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--config')
     os.makedirs(CERT_FOLDER, exist_ok=True)
+    sign_args = (cert, key, password, signature_field) if sign else None
+    try:
+        # Loaded before any worker starts: a pool whose initializer fails respawns its workers forever
+        signing = signing_session(sign_args)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    metrics = Metrics(metrics_log or os.path.join(CERT_FOLDER, METRICS_FILE))
+    registry = Registry(registry_path or os.path.join(CERT_FOLDER, REGISTRY_FILE))
+    signer = signing.fingerprint if signing else None
 
-    for _, row in df.iterrows():
-        name = str(row['name']).strip()
-        cert_no = str(row['cert_no']).strip()
-        to_email = row['email']
+    bg_image, sample_bytes = prepare_background(bg_image, paper_size, orientation, layout_cfg, bg_dpi, bg_jpeg_quality,
+                                                os.path.join(CERT_FOLDER, CACHE_DIR))
+    if sample_bytes:
+        before, after = sample_bytes
+        if after < before:
+            print(f"🗜 Background optimized: {before / 1024:.0f} KB → {after / 1024:.0f} KB per certificate")
+        else:
+            print(f"🗜 Background already compact, {before / 1024:.0f} KB per certificate")
 
-        filename = f"{name.replace(' ', '_')}_{cert_no}.pdf"
-        pdf_path = os.path.join(CERT_FOLDER, filename)
+    if merge:
+        template = CertificateTemplate(bg_image, paper_size, orientation)
+        try:
+            count, merged_path = write_merged(
+                rows, template, layout_cfg, os.path.join(CERT_FOLDER, MERGED_FILE), signing,
+                on_row=lambda name, cert_no: print(f"✔ Certificate for {name} (Code: {cert_no}) generated."),
+                metrics=metrics,
+                registry=registry
+            )
+        finally:
+            metrics.close()
+            registry.close()
+        print(f"\n{count} certificate(s) written to '{merged_path}'.")
+        print(metrics.format_summary())
+        return
 
-        create_certificate(name, cert_no, bg_image, pdf_path, paper_size, orientation, layout_cfg)
+    workers = workers or os.cpu_count()
+    journal_path = journal_path or os.path.join(CERT_FOLDER, JOURNAL_FILE)
+    # A fresh run starts a fresh journal; --resume picks up where the last one stopped
+    journal = Journal(journal_path, reset=not resume)
 
-        final_path = digitally_sign(cert, key, password, pdf_path) if sign else pdf_path
+    if workers > 1:
+        pool = multiprocessing.Pool(
+            workers,
+            initializer=_init_worker,
+            initargs=(bg_image, paper_size, orientation, layout_cfg, CERT_FOLDER, sign_args, journal_path, resume, incremental,
+                      layout, shard_digits, bool(archive_path))
+        )
+        results = pool.imap(_render_row_in_worker, rows, chunk_size or auto_chunk_size(count_rows(excel), workers))
+    else:
+        pool = None
+        template = CertificateTemplate(bg_image, paper_size, orientation, reproducible=incremental)
+        fingerprint = batch_fingerprint(template, layout_cfg, signing) if incremental else None
+        results = (
+            render_row(row, template, layout_cfg, CERT_FOLDER, signing, journal, resume, fingerprint, layout, shard_digits,
+                       bool(archive_path))
+            for row in rows
+        )
+
+    # Emails are queued in the outbox and sent from there by a delivery thread,
+    # so a slow or failing mail server never holds up generation
+    outbox = Outbox(outbox_path or os.path.join(CERT_FOLDER, OUTBOX_FOLDER)) if email else None
+    mailer = Mailer(
+        sender, app_pass,
+        host=smtp_host,
+        port=smtp_port,
+        security=smtp_security,
+        connections=smtp_connections,
+        max_messages_per_connection=max_per_connection,
+        rate=send_rate,
+        timeout=smtp_timeout
+    ) if email and deliver else None
+    delivery = Delivery(
+        outbox, mailer, smtp_connections, max_attempts,
+        max_per_hour=max_per_hour,
+        metrics=metrics,
+        on_sent=lambda cert_no, to_email: journal.mark(cert_no, 'emailed', to_email)
+    ) if mailer else None
+
+    def spool(result):
+        name, cert_no, to_email, final_path, skipped, events, sha256, data = result
+        if skipped == 'up-to-date':
+            return None
+        if resume and {'queued', 'emailed'} & set(journal.stages(cert_no)):
+            return f"📧 Email to {to_email} already queued, skipped"
+        outbox.put(build_message(sender, to_email, "Your Certificate", certificate_email_body(name, cert_no), final_path, cert_no))
+        journal.mark(cert_no, 'queued', to_email)
+        return f"📨 Email to {to_email} queued"
+
+    # Rendering and signing keep running while earlier certificates are queued
+    batch = pipelined(results, spool if email else None, 1, queue_size)
+    archive = ArchiveWriter(archive_path) if archive_path else None
+    generating = threading.Event()
+    if delivery is not None:
+        generating.set()
+        delivery_thread = threading.Thread(target=delivery.run, args=(generating, False, LINGER), daemon=True)
+        delivery_thread.start()
+    try:
+        count = 0
+        for (name, cert_no, to_email, final_path, skipped, events, sha256, data), email_status in batch:
+            # Worker processes hand their stage timings back with the result
+            metrics.extend(events)
+            if archive is not None:
+                with metrics.stage('write', cert_no) as event:
+                    archive.add(final_path, data)
+                    event['bytes'] = len(data)
+                final_path = os.path.join(archive_path, final_path)
+            if not skipped:
+                registry.record(cert_no, name, to_email, final_path, sha256, signer)
+            if email_status:
+                print(email_status)
 
-        if email:
-            send_email(sender, app_pass, to_email,
-                       subject="Your Certificate",
-                       body=f"Dear {name},\n\nPlease find your certificate attached.\n\nCertificate Code: {cert_no}\n\nRegards,\nTeam",
-                       attachment=final_path)
+            if skipped == 'up-to-date':
+                print(f"↷ Certificate for {name} (Code: {cert_no}) is up to date, skipped.")
+            elif skipped:
+                print(f"↷ Certificate for {name} (Code: {cert_no}) already generated, skipped.")
+            else:
+                print(f"✔ Certificate for {name} (Code: {cert_no}) generated.")
+            count += 1
+    except BaseException:
+        if delivery is not None:
+            delivery.cancel()
+        raise
+    finally:
+        batch.close()
+        if delivery is not None:
+            generating.clear()
+            delivery_thread.join()
+        if mailer is not None:
+            mailer.close()
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        if archive is not None:
+            archive.close()
+        journal.close()
+        metrics.close()
+        registry.close()
 
-        print(f"✔ Certificate for {name} (Code: {cert_no}) generated.")
+    print(f"\n{count} certificate(s) written to '{archive_path or CERT_FOLDER}'.")
+    if delivery is not None:
+        print(delivery.summary())
+        if delivery.fatal is not None:
+            print(f"❌ Email delivery stopped: {delivery.fatal}")
+    elif outbox is not None:
+        print(f"📨 {outbox.counts()['new']} email(s) queued in '{outbox.path}', send them with outbox.py")
+    print(metrics.format_summary())
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()
     main()
@@ -1,16 +1,30 @@
-import sys, os, json, fitz, subprocess
-import pandas as pd
+import sys, os, json, subprocess, threading, time
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QFileDialog, QVBoxLayout, QLabel, QPushButton, QLineEdit,
-    QComboBox, QTextEdit, QCheckBox, QHBoxLayout, QGroupBox, QProgressBar, QMessageBox,
+    QComboBox, QPlainTextEdit, QCheckBox, QHBoxLayout, QGroupBox, QProgressBar, QMessageBox,
     QTabWidget, QSpinBox, QColorDialog, QScrollArea
 )
-from PyQt5.QtGui import QPixmap, QImage
-from PyQt5.QtCore import Qt
-from certigo import create_certificate, digitally_sign, send_email
+from PyQt5.QtGui import QPixmap, QImage, QPainter
+from PyQt5.QtCore import Qt, QThread, QTimer, pyqtSignal
+from mailer import Mailer
+from pipeline import pipelined
+from rows import iter_rows, count_rows
+from metrics import Metrics
+from outbox import Outbox, Delivery, OUTBOX_FOLDER, LINGER, build_message
+from registry import Registry
+from background import CACHE_DIR, DEFAULT_DPI
+from output import LAYOUTS, ArchiveWriter
+from certigo import (
+    ARCHIVE_FILE, MERGED_FILE, METRICS_FILE, REGISTRY_FILE, CertificateTemplate, render_row, write_merged, prepare_background, is_pdf, signing_session,
+    page_size_for, certificate_email_body
+)
 
 CONFIG_PATH = "config.json"
-PREVIEW_PDF = "__preview__.pdf"
+PREVIEW_DPI = 100
+PREVIEW_DELAY_MS = 150
+EMAIL_CONNECTIONS = 2
+LOG_MAX_LINES = 5000
+UPDATE_INTERVAL = 0.1
 
 class CertigoGUI(QWidget):
     def __init__(self):
@@ -38,12 +52,24 @@ class CertigoGUI(QWidget):
     def build_main_tab(self):
         layout = QVBoxLayout()
 
-        self.excel_input = self.add_file_input("Excel File (.xlsx)", "*.xlsx", layout)
-        self.bg_input = self.add_file_input("Background Image", "*.png *.jpg", layout)
+        self.excel_input = self.add_file_input("Data File (.xlsx, .csv, .parquet)", "*.xlsx *.csv *.parquet", layout)
+        self.bg_input = self.add_file_input("Background Image or PDF", "*.png *.jpg *.pdf", layout)
         self.output_dir_input = self.add_folder_input("Output Folder", layout)
         self.paper_size = self.add_dropdown("Paper Size", ["A4", "LETTER"], layout)
         self.orientation = self.add_dropdown("Orientation", ["landscape", "portrait"], layout)
 
+        self.optimize_checkbox = QCheckBox(f"Optimize background image for screen ({DEFAULT_DPI} DPI)")
+        # Off by default: resampling is lossy and certificates are often printed
+        self.optimize_checkbox.setChecked(False)
+        layout.addWidget(self.optimize_checkbox)
+
+        self.merge_checkbox = QCheckBox("Merge all certificates into a single PDF")
+        layout.addWidget(self.merge_checkbox)
+
+        self.layout_dropdown = self.add_dropdown("Folder Layout", list(LAYOUTS), layout)
+        self.archive_checkbox = QCheckBox(f"Write certificates into a single {ARCHIVE_FILE}")
+        layout.addWidget(self.archive_checkbox)
+
         self.sign_checkbox = QCheckBox("Enable Digital Signing")
         self.sign_checkbox.stateChanged.connect(self.toggle_sign_section)
         layout.addWidget(self.sign_checkbox)
@@ -83,16 +109,32 @@ class CertigoGUI(QWidget):
         self.email_group.setLayout(email_layout)
         layout.addWidget(self.email_group)
 
+        run_hbox = QHBoxLayout()
         self.run_button = QPushButton("Generate Certificates")
         self.run_button.clicked.connect(self.run_certigo)
-        layout.addWidget(self.run_button)
+        run_hbox.addWidget(self.run_button)
+        self.pause_button = QPushButton("Pause")
+        self.pause_button.setEnabled(False)
+        self.pause_button.clicked.connect(self.toggle_pause)
+        run_hbox.addWidget(self.pause_button)
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.setEnabled(False)
+        self.cancel_button.clicked.connect(self.cancel_batch)
+        run_hbox.addWidget(self.cancel_button)
+        layout.addLayout(run_hbox)
+        self.worker = None
 
         self.progress_bar = QProgressBar()
         self.progress_bar.setVisible(False)
         layout.addWidget(self.progress_bar)
 
-        self.log_output = QTextEdit()
+        self.stats_label = QLabel()
+        self.stats_label.setVisible(False)
+        layout.addWidget(self.stats_label)
+
+        self.log_output = QPlainTextEdit()
         self.log_output.setReadOnly(True)
+        self.log_output.setMaximumBlockCount(LOG_MAX_LINES)
         layout.addWidget(self.log_output)
 
         self.main_tab.setLayout(layout)
@@ -121,6 +163,14 @@ class CertigoGUI(QWidget):
         self.config = self.load_config()
         self.setting_fields = {}
 
+        # Edits restart the timer, so a burst of changes triggers one redraw
+        self.preview_timer = QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(PREVIEW_DELAY_MS)
+        self.preview_timer.timeout.connect(self.update_preview)
+        self.preview_bg_key = None
+        self.preview_bg = None
+
         for key in ["name", "cert_no"]:
             group = QGroupBox(f"{key.upper()} Settings")
             vbox = QVBoxLayout()
@@ -134,17 +184,24 @@ class CertigoGUI(QWidget):
                     spin = QSpinBox()
                     spin.setMaximum(5000)
                     spin.setValue(self.config[key].get(field, 0))
+                    spin.valueChanged.connect(self.schedule_preview)
                     hbox.addWidget(spin)
                     self.setting_fields[key][field] = spin
                 elif field == "align":
                     cb = QComboBox()
                     cb.addItems(["left", "center"])
                     cb.setCurrentText(self.config[key].get(field, "left"))
+                    cb.currentTextChanged.connect(self.schedule_preview)
                     hbox.addWidget(cb)
                     self.setting_fields[key][field] = cb
                 else:
                     txt = QLineEdit(self.config[key].get(field, ""))
+                    txt.textChanged.connect(self.schedule_preview)
                     hbox.addWidget(txt)
+                    # A built-in font name, or a TrueType file picked here
+                    font_btn = QPushButton("Browse")
+                    font_btn.clicked.connect(lambda _, le=txt: self.browse_file(le, "Fonts (*.ttf *.otf *.ttc)"))
+                    hbox.addWidget(font_btn)
                     self.setting_fields[key][field] = txt
                 vbox.addLayout(hbox)
 
@@ -170,8 +227,18 @@ class CertigoGUI(QWidget):
         hbox.addWidget(preview_btn)
 
         layout.addLayout(hbox)
+
+        self.live_preview_label = QLabel("Select a background image to see a preview.")
+        self.live_preview_label.setAlignment(Qt.AlignCenter)
+        self.live_preview_label.setMinimumHeight(300)
+        layout.addWidget(self.live_preview_label)
         self.settings_tab.setLayout(layout)
 
+        self.bg_input.textChanged.connect(self.schedule_preview)
+        for widget in (self.paper_size, self.orientation):
+            widget.currentTextChanged.connect(self.schedule_preview)
+        self.schedule_preview()
+
     def build_preview_tab(self):
         layout = QVBoxLayout()
         self.preview_label = QLabel("No preview yet.")
@@ -197,35 +264,87 @@ class CertigoGUI(QWidget):
             rgb = [color.red(), color.green(), color.blue()]
             self.config[key]["color"] = rgb
             self.setting_fields[key]["color_label"].setText("Current Color: " + str(rgb))
+            self.schedule_preview()
 
-    def save_config(self):
+    def read_setting_fields(self):
         for key in self.setting_fields:
             for field in ["x", "y", "font", "size", "align"]:
                 widget = self.setting_fields[key][field]
                 self.config[key][field] = widget.currentText() if isinstance(widget, QComboBox) else widget.text() if isinstance(widget, QLineEdit) else widget.value()
+        return self.config
+
+    def save_config(self):
+        self.read_setting_fields()
         with open(CONFIG_PATH, 'w') as f:
             json.dump(self.config, f, indent=2)
         QMessageBox.information(self, "Saved", "Configuration updated successfully.")
 
-    def generate_preview(self):
+    def schedule_preview(self, *args):
+        self.preview_timer.start()
+
+    # A text-only template and the background scaled to the preview size,
+    # rebuilt only when the image, paper size or orientation change. The
+    # template has no background, so the image is never encoded for the PDF.
+    def preview_background(self):
         bg = self.bg_input.text()
-        if not os.path.exists(bg):
+        key = (bg, os.path.getmtime(bg), self.paper_size.currentText(), self.orientation.currentText())
+        if key != self.preview_bg_key:
+            template = CertificateTemplate('', key[2], key[3])
+            width, height = (round(v * PREVIEW_DPI / 72) for v in page_size_for(key[2], key[3]))
+            image = self.rasterize_pdf(bg) if is_pdf(bg) else QImage(bg)
+            if image.isNull():
+                raise ValueError(f"Could not read background image '{bg}'")
+            image = image.convertToFormat(QImage.Format_RGB888).scaled(
+                width, height, Qt.IgnoreAspectRatio, Qt.SmoothTransformation
+            )
+            self.preview_bg = template, image
+            self.preview_bg_key = key
+        return self.preview_bg
+
+    def rasterize_pdf(self, path):
+        import fitz
+        with fitz.open(path) as doc:
+            pix = doc[0].get_pixmap(dpi=PREVIEW_DPI)
+            return QImage(pix.samples, pix.width, pix.height, pix.stride, QImage.Format_RGB888).copy()
+
+    # Renders only the text layer in memory and paints it over the cached background
+    def render_preview(self):
+        import fitz
+        template, background = self.preview_background()
+        text_pdf = template.render_text_bytes("John Doe", "PREVIEW123", self.read_setting_fields())
+        with fitz.open(stream=text_pdf, filetype="pdf") as doc:
+            pix = doc[0].get_pixmap(dpi=PREVIEW_DPI, alpha=True)
+            overlay = QImage(pix.samples, pix.width, pix.height, pix.stride, QImage.Format_RGBA8888).copy()
+        image = background.copy()
+        painter = QPainter(image)
+        painter.drawImage(0, 0, overlay)
+        painter.end()
+        return QPixmap.fromImage(image)
+
+    def update_preview(self):
+        if not os.path.exists(self.bg_input.text()):
+            self.live_preview_label.setText("Select a background image to see a preview.")
+            return False
+        try:
+            pixmap = self.render_preview()
+        except Exception as e:
+            self.live_preview_label.setText(f"Could not render preview: {e}")
+            return False
+        self.live_preview_label.setPixmap(pixmap.scaled(
+            self.live_preview_label.width(), self.live_preview_label.height(), Qt.KeepAspectRatio, Qt.SmoothTransformation
+        ))
+        self.preview_label.setPixmap(pixmap)
+        return True
+
+    def generate_preview(self):
+        if not os.path.exists(self.bg_input.text()):
             QMessageBox.warning(self, "Missing Background", "Please select a background image.")
             return
-        orientation = self.orientation.currentText()
-        paper_size = self.paper_size.currentText()
-        create_certificate("John Doe", "PREVIEW123", bg, PREVIEW_PDF, paper_size, orientation, self.config)
-
-        try:
-            doc = fitz.open(PREVIEW_PDF)
-            page = doc[0]
-            pix = page.get_pixmap(dpi=150)
-            img = QImage(pix.samples, pix.width, pix.height, pix.stride, QImage.Format_RGB888)
-            pixmap = QPixmap.fromImage(img)
-            self.preview_label.setPixmap(pixmap)
+        self.preview_timer.stop()
+        if self.update_preview():
             self.tabs.setCurrentWidget(self.preview_tab)
-        except Exception as e:
-            QMessageBox.critical(self, "Preview Error", f"Could not render preview: {e}")
+        else:
+            QMessageBox.critical(self, "Preview Error", self.live_preview_label.text())
 
     # ========== HELPERS ==========
     def add_file_input(self, label, file_filter, layout):
@@ -294,68 +413,312 @@ class CertigoGUI(QWidget):
         QMessageBox.information(self, "Gmail App Password Instructions", text)
 
     def log(self, message):
-        self.log_output.append(message)
+        self.append_log([message])
+
+    def append_log(self, lines):
+        # One append per batch of lines; the widget drops the oldest lines past LOG_MAX_LINES
+        self.log_output.appendPlainText("\n".join(lines))
         self.log_output.verticalScrollBar().setValue(self.log_output.verticalScrollBar().maximum())
 
+    def show_stats(self, summary):
+        parts = []
+        for r in summary:
+            part = f"{r['stage']} {r['mean_ms']:.0f} ms avg"
+            if r['failures']:
+                part += f", {r['failures']} failed"
+            if r['retries']:
+                part += f", {r['retries']} retried"
+            parts.append(part)
+        self.stats_label.setText(" · ".join(parts))
+        self.stats_label.setVisible(bool(parts))
+
+    def show_progress(self, done, total):
+        # The row count is an estimate for some inputs, never let the bar overflow
+        self.progress_bar.setMaximum(max(total, done))
+        self.progress_bar.setValue(done)
+
     def run_certigo(self):
+        output_folder = self.output_dir_input.text().strip()
+        if not output_folder:
+            QMessageBox.warning(self, "Missing Output Folder", "Please select an output folder.")
+            return
+        email = self.email_checkbox.isChecked()
+        merge = self.merge_checkbox.isChecked()
+        archive = self.archive_checkbox.isChecked()
+        if merge and email:
+            QMessageBox.warning(self, "Merge and Email", "A merged PDF can't be emailed per recipient. Disable one of the two options.")
+            return
+        if archive and (merge or email):
+            QMessageBox.warning(self, "Archive", "The archive holds separate certificates and can't be merged or emailed. Disable one of the options.")
+            return
+
+        # Everything the worker needs is read from the widgets here, on the UI thread
+        job = {
+            'excel': self.excel_input.text(),
+            'bg': self.bg_input.text(),
+            'paper_size': self.paper_size.currentText(),
+            'orientation': self.orientation.currentText(),
+            'output_folder': output_folder,
+            'sign': self.sign_checkbox.isChecked(),
+            'cert': self.cert_input.text(),
+            'key': self.key_input.text(),
+            'password': self.pass_input.text(),
+            'email': email,
+            'sender': self.sender_input.text(),
+            'app_pass': self.app_pass_input.text(),
+            'merge': merge,
+            'layout': self.layout_dropdown.currentText(),
+            'archive': archive,
+            'optimize': self.optimize_checkbox.isChecked(),
+        }
+
+        self.worker = BatchWorker(job)
+        self.worker.progress.connect(self.show_progress)
+        self.worker.log_lines.connect(self.append_log)
+        self.worker.stats.connect(self.show_stats)
+        self.worker.succeeded.connect(lambda message: QMessageBox.information(self, "Done", message))
+        self.worker.failed.connect(self.batch_failed)
+        self.worker.finished.connect(self.batch_finished)
+
+        self.progress_bar.setVisible(True)
+        self.progress_bar.setMaximum(0)
+        self.progress_bar.setValue(0)
+        self.run_button.setEnabled(False)
+        self.pause_button.setText("Pause")
+        self.pause_button.setEnabled(True)
+        self.cancel_button.setEnabled(True)
+        self.worker.start()
+
+    def toggle_pause(self):
+        if self.worker is None:
+            return
+        if self.worker.paused():
+            self.worker.resume()
+            self.pause_button.setText("Pause")
+        else:
+            self.worker.pause()
+            self.pause_button.setText("Resume")
+
+    def cancel_batch(self):
+        if self.worker is not None:
+            self.cancel_button.setEnabled(False)
+            self.pause_button.setEnabled(False)
+            self.worker.cancel()
+
+    def batch_failed(self, message):
+        self.log(f"❌ Error: {message}")
+        QMessageBox.critical(self, "Error", message)
+
+    def batch_finished(self):
+        self.worker = None
+        self.run_button.setEnabled(True)
+        self.pause_button.setText("Pause")
+        self.pause_button.setEnabled(False)
+        self.cancel_button.setEnabled(False)
+
+    def closeEvent(self, event):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.worker.wait()
+        super().closeEvent(event)
+
+class BatchCancelled(Exception):
+    pass
+
+# Runs a batch off the UI thread. Progress, log lines and stage stats are
+# collected here and sent to the window at most every UPDATE_INTERVAL seconds,
+# so the UI stays responsive however fast rows finish.
+class BatchWorker(QThread):
+    progress = pyqtSignal(int, int)
+    log_lines = pyqtSignal(list)
+    stats = pyqtSignal(list)
+    succeeded = pyqtSignal(str)
+    failed = pyqtSignal(str)
+
+    def __init__(self, job):
+        super().__init__()
+        self.job = job
+        self.cancelled = threading.Event()
+        self.running = threading.Event()
+        self.running.set()
+        self.pending_lines = []
+        self.log_lock = threading.Lock()
+        self.done = 0
+        self.total = 0
+        self.metrics = None
+        self.delivery = None
+        self.last_update = 0
+
+    # Pausing and cancelling also reach the email delivery, which keeps
+    # sending after the last certificate is made
+    def pause(self):
+        self.running.clear()
+        if self.delivery is not None:
+            self.delivery.pause()
+
+    def resume(self):
+        self.running.set()
+        if self.delivery is not None:
+            self.delivery.resume()
+
+    def paused(self):
+        return not self.running.is_set()
+
+    def cancel(self):
+        self.cancelled.set()
+        self.running.set()
+        if self.delivery is not None:
+            self.delivery.cancel()
+
+    # Called between rows: blocks while paused and stops the batch once cancelled
+    def checkpoint(self):
+        if not self.running.is_set():
+            self.flush()
+            self.running.wait()
+        if self.cancelled.is_set():
+            raise BatchCancelled()
+
+    # Also called from the email delivery thread
+    def log(self, message):
+        with self.log_lock:
+            self.pending_lines.append(message)
+
+    def row_done(self):
+        self.done += 1
+        if time.monotonic() - self.last_update >= UPDATE_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        self.last_update = time.monotonic()
+        with self.log_lock:
+            lines, self.pending_lines = self.pending_lines, []
+        if lines:
+            self.log_lines.emit(lines)
+        self.progress.emit(self.done, self.total)
+        if self.metrics is not None:
+            self.stats.emit(self.metrics.summary())
+
+    def run(self):
+        batch = mailer = registry = archive = delivery = None
+        generating = threading.Event()
+        job = self.job
         try:
-            df = pd.read_excel(self.excel_input.text())
+            rows = iter_rows(job['excel'])
             with open(CONFIG_PATH) as f:
                 config = json.load(f)
-            bg = self.bg_input.text()
-            paper_size = self.paper_size.currentText()
-            orientation = self.orientation.currentText()
-            output_folder = self.output_dir_input.text().strip()
-
-            if not output_folder:
-                QMessageBox.warning(self, "Missing Output Folder", "Please select an output folder.")
-                return
-
+            output_folder = job['output_folder']
             os.makedirs(output_folder, exist_ok=True)
+            bg, sample_bytes = prepare_background(
+                job['bg'], job['paper_size'], job['orientation'], config, DEFAULT_DPI if job['optimize'] else 0,
+                cache_dir=os.path.join(output_folder, CACHE_DIR)
+            )
+            if sample_bytes and sample_bytes[1] < sample_bytes[0]:
+                self.log(f"🗜 Background optimized: {sample_bytes[0] / 1024:.0f} KB → {sample_bytes[1] / 1024:.0f} KB per certificate")
+            template = CertificateTemplate(bg, job['paper_size'], job['orientation'])
+            self.total = count_rows(job['excel']) or 0
+            self.metrics = Metrics(os.path.join(output_folder, METRICS_FILE))
+            registry = Registry(os.path.join(output_folder, REGISTRY_FILE))
+
+            signing = signing_session((job['cert'], job['key'], job['password'])) if job['sign'] else None
+            if job['email']:
+                # Emails are queued in the outbox and sent from there while certificates are still being made
+                outbox = Outbox(os.path.join(output_folder, OUTBOX_FOLDER))
+                mailer = Mailer(job['sender'], job['app_pass'], connections=EMAIL_CONNECTIONS)
+                delivery = self.delivery = Delivery(outbox, mailer, EMAIL_CONNECTIONS, metrics=self.metrics, log=self.log)
+                if self.paused():
+                    delivery.pause()
+                generating.set()
+                delivery_thread = threading.Thread(target=delivery.run, args=(generating, False, LINGER), daemon=True)
+                delivery_thread.start()
+
+            def spool(result):
+                name, cert_no, to_email, final_path, skipped, events, sha256, data = result
+                outbox.put(build_message(
+                    job['sender'],
+                    to_email,
+                    "Your Certificate",
+                    certificate_email_body(name, cert_no),
+                    final_path,
+                    cert_no
+                ))
+                return f"📨 Email to {to_email} queued"
+
+            if job['merge']:
+                def on_row(name, cert_no):
+                    self.log(f"✔ Added certificate for {name}")
+                    self.row_done()
+                    self.checkpoint()
+
+                count, merged_path = write_merged(
+                    rows, template, config, os.path.join(output_folder, MERGED_FILE), signing, on_row, self.metrics,
+                    registry
+                )
+                if signing:
+                    self.log(f"🔏 Signed {merged_path}")
+                self.total = count
+                self.flush()
+                self.succeeded.emit(f"{count} certificates written to {merged_path}.")
+                return
 
-            sign = self.sign_checkbox.isChecked()
-            email = self.email_checkbox.isChecked()
-
-            self.progress_bar.setVisible(True)
-            self.progress_bar.setMaximum(len(df))
-            self.progress_bar.setValue(0)
-
-            for i, (_, row) in enumerate(df.iterrows()):
-                name = str(row['name']).strip()
-                cert_no = str(row['cert_no']).strip()
-                to_email = row['email']
-                filename = f"{name.replace(' ', '_')}_{cert_no}.pdf"
-                pdf_path = os.path.join(output_folder, filename)
-
-                create_certificate(name, cert_no, bg, pdf_path, paper_size, orientation, config)
+            # Rendering and signing keep running while earlier certificates are queued
+            results = (
+                render_row(row, template, config, output_folder, signing, layout=job['layout'], archive=job['archive'])
+                for row in rows
+            )
+            batch = pipelined(results, spool if delivery else None)
+            if job['archive']:
+                archive = ArchiveWriter(os.path.join(output_folder, ARCHIVE_FILE))
+            for (name, cert_no, to_email, final_path, skipped, events, sha256, data), email_status in batch:
+                self.metrics.extend(events)
+                if archive is not None:
+                    with self.metrics.stage('write', cert_no) as event:
+                        archive.add(final_path, data)
+                        event['bytes'] = len(data)
+                    final_path = os.path.join(archive.path, final_path)
+                registry.record(cert_no, name, to_email, final_path, sha256, signing.fingerprint if signing else None)
                 self.log(f"✔ Created certificate for {name}")
-
-                final_path = pdf_path
-                if sign:
-                    final_path = digitally_sign(
-                        self.cert_input.text(),
-                        self.key_input.text(),
-                        self.pass_input.text(),
-                        pdf_path
-                    )
+                if signing:
                     self.log(f"🔏 Signed certificate for {name}")
-
-                if email:
-                    send_email(
-                        self.sender_input.text(),
-                        self.app_pass_input.text(),
-                        to_email,
-                        subject="Your Certificate",
-                        body=f"Dear {name},\n\nPlease find your certificate attached.\n\nCertificate Code: {cert_no}\n\nRegards,\nTeam",
-                        attachment=final_path
-                    )
-
-                self.progress_bar.setValue(i + 1)
-
-            QMessageBox.information(self, "Done", "All certificates processed successfully.")
+                if email_status:
+                    self.log(email_status)
+                self.row_done()
+                self.checkpoint()
+
+            # Settle the bar on the real total
+            self.total = self.done
+            self.flush()
+            if delivery is not None:
+                generating.clear()
+                delivery_thread.join()
+                self.log(delivery.summary())
+                self.flush()
+                if self.cancelled.is_set():
+                    raise BatchCancelled()
+                if delivery.fatal is not None:
+                    self.failed.emit(f"Email delivery stopped: {delivery.fatal}")
+                    return
+            self.succeeded.emit(f"All certificates written to {archive.path}." if archive else "All certificates processed successfully.")
+        except BatchCancelled:
+            self.log(f"⏹ Cancelled after {self.done} certificate(s).")
+            self.flush()
         except Exception as e:
-            self.log(f"❌ Error: {e}")
-            QMessageBox.critical(self, "Error", str(e))
+            self.flush()
+            self.failed.emit(str(e))
+        finally:
+            if batch is not None:
+                batch.close()
+            if delivery is not None:
+                delivery.cancel()
+                generating.clear()
+                delivery_thread.join()
+            if mailer is not None:
+                mailer.close()
+            if archive is not None:
+                archive.close()
+            if self.metrics is not None:
+                self.metrics.close()
+            if registry is not None:
+                registry.close()
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
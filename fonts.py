@@ -0,0 +1,57 @@
+import os
+import re
+import hashlib
+import threading
+
+FONT_FILE_TYPES = ('.ttf', '.otf', '.ttc')
+FIELDS = ('name', 'cert_no')
+
+# Font files registered in this process, by absolute path
+_registered = {}
+_lock = threading.Lock()
+
+
+def is_font_file(font):
+    return str(font).lower().endswith(FONT_FILE_TYPES)
+
+
+# Name reportlab knows a layout font by. Built-in Type1 fonts are used as they
+# are; a TrueType file is parsed and registered the first time this process
+# needs it and reused for every certificate after that. Each PDF embeds a
+# subset holding only the glyphs it uses.
+def font_name(font):
+    if not is_font_file(font):
+        return font
+    path = os.path.abspath(font)
+    with _lock:
+        name = _registered.get(path)
+        if name is None:
+            from reportlab.pdfbase import pdfmetrics
+            from reportlab.pdfbase.ttfonts import TTFont, TTFError
+            stem = re.sub(r'[^A-Za-z0-9-]', '', os.path.splitext(os.path.basename(path))[0]) or 'Font'
+            name = f"{stem}-{hashlib.sha1(path.encode()).hexdigest()[:8]}"
+            try:
+                # asciiReadable would put all of ASCII into every subset, used or not
+                pdfmetrics.registerFont(TTFont(name, path, asciiReadable=False))
+            except (OSError, TTFError) as e:
+                raise ValueError(
+                    f"Could not load font '{font}': {e}. Fonts must be TrueType (.ttf, or .otf with TrueType outlines)."
+                ) from e
+            _registered[path] = name
+    return name
+
+
+# Parse the layout's font files up front, so the first certificate doesn't pay for it
+def register_fonts(layout_cfg):
+    for field in FIELDS:
+        font_name(layout_cfg[field]['font'])
+
+
+# Digest of the font files the layout uses, so editing a font invalidates incremental builds
+def fonts_digest(layout_cfg):
+    h = hashlib.sha256()
+    fonts = sorted({layout_cfg[field]['font'] for field in FIELDS if is_font_file(layout_cfg[field]['font'])})
+    for font in fonts:
+        with open(font, 'rb') as f:
+            h.update(hashlib.sha256(f.read()).digest())
+    return h.hexdigest() if fonts else ''
@@ -0,0 +1,11 @@
+import os
+import subprocess
+
+
+# Short hash of the checked-out commit, or None outside a git checkout
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
@@ -0,0 +1,76 @@
+import os
+import sqlite3
+import threading
+import time
+
+STAGES = ('rendered', 'signed', 'queued', 'emailed')
+
+
+# Per-row record of finished stages, keyed by cert_no, so an interrupted run can
+# be resumed without regenerating or re-emailing finished rows. Every process
+# opens its own Journal on the same file; SQLite serialises the writers.
+class Journal:
+    def __init__(self, path, reset=False):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS stages ("
+            " cert_no TEXT NOT NULL,"
+            " stage TEXT NOT NULL,"
+            " output TEXT,"
+            " finished_at REAL NOT NULL,"
+            " PRIMARY KEY (cert_no, stage))"
+        )
+        # Input fingerprint of each output file, kept across runs for incremental
+        # builds. NULL when the file was last written by a non-incremental run.
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS outputs ("
+            " path TEXT PRIMARY KEY,"
+            " fingerprint TEXT)"
+        )
+        if reset:
+            self.conn.execute("DELETE FROM stages")
+
+    def mark(self, cert_no, stage, output=None):
+        if stage not in STAGES:
+            raise ValueError(f"Unknown journal stage '{stage}'")
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO stages (cert_no, stage, output, finished_at) VALUES (?, ?, ?, ?)",
+                (cert_no, stage, output, time.time())
+            )
+
+    def stages(self, cert_no):
+        with self.lock:
+            return dict(self.conn.execute("SELECT stage, output FROM stages WHERE cert_no = ?", (cert_no,)))
+
+    def has(self, cert_no, stage):
+        return stage in self.stages(cert_no)
+
+    def record_output(self, path, fingerprint):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO outputs (path, fingerprint) VALUES (?, ?)",
+                (os.path.normpath(path), fingerprint)
+            )
+
+    def output_fingerprint(self, path):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT fingerprint FROM outputs WHERE path = ?", (os.path.normpath(path),)
+            ).fetchone()
+        return row[0] if row else None
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
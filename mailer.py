@@ -0,0 +1,134 @@
+import queue
+import smtplib
+import threading
+import time
+
+SMTP_HOST = "smtp.gmail.com"
+SMTP_PORT = 587
+SMTP_SECURITY = ('starttls', 'ssl', 'none')
+# Seconds to wait on the server before a connection counts as dropped
+SMTP_TIMEOUT = 60
+
+# Errors after which the connection is dropped and the message retried on a fresh one
+RECONNECT_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError, TimeoutError)
+
+
+# One authenticated SMTP session, reopened when the server drops it or after
+# max_messages messages so long batches don't hit per-connection limits.
+class SMTPConnection:
+    def __init__(self, user, password, host, port, security, max_messages, timeout=SMTP_TIMEOUT):
+        # Only loaded when a batch actually sends email
+        import yagmail
+        self.client = yagmail.SMTP(
+            user=user,
+            password=password,
+            host=host,
+            port=port,
+            smtp_starttls=security == 'starttls',
+            smtp_ssl=security == 'ssl',
+            smtp_skip_login=not password,
+            timeout=timeout
+        )
+        self.max_messages = max_messages
+        self.sent = 0
+        self.open = False
+
+    def connect(self):
+        self.client.login()
+        self.open = True
+        self.sent = 0
+
+    def close(self):
+        if self.open:
+            self.open = False
+            self.client.close()
+
+    # Closes the socket of a connection that failed; the server may be gone, so no QUIT is sent
+    def drop(self):
+        self.open = False
+        if self.client.smtp is not None:
+            try:
+                self.client.smtp.close()
+            except (smtplib.SMTPException, OSError):
+                pass
+
+    def sendmail(self, recipients, message):
+        if self.open and self.max_messages and self.sent >= self.max_messages:
+            self.close()
+        try:
+            if not self.open:
+                self.connect()
+            self.client.smtp.sendmail(self.client.user, recipients, message)
+        except RECONNECT_ERRORS:
+            self.drop()
+            raise
+        self.sent += 1
+
+
+# Pool of persistent SMTP connections shared by every send in a batch
+class Mailer:
+    def __init__(self, user, password, host=SMTP_HOST, port=SMTP_PORT, security='starttls',
+                 connections=1, max_messages_per_connection=100, rate=0, retries=2, timeout=SMTP_TIMEOUT):
+        if security not in SMTP_SECURITY:
+            raise ValueError(f"Unknown SMTP security '{security}', expected one of {', '.join(SMTP_SECURITY)}")
+        self.connections = [
+            SMTPConnection(user, password, host, port, security, max_messages_per_connection, timeout)
+            for _ in range(max(1, connections))
+        ]
+        self.idle = queue.LifoQueue()
+        for conn in self.connections:
+            self.idle.put(conn)
+        self.interval = 1 / rate if rate else 0
+        self.next_send = 0
+        self.rate_lock = threading.Lock()
+        self.retries = retries
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    # Spread sends evenly so the whole pool stays under `rate` messages per second
+    def throttle(self):
+        if not self.interval:
+            return
+        with self.rate_lock:
+            now = time.monotonic()
+            wait = self.next_send - now
+            self.next_send = max(now, self.next_send) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+    # Returns how many retries the message needed. Building the message doesn't
+    # touch the socket, so it doesn't wait for an idle connection.
+    def send(self, to, subject, contents, attachments=None):
+        recipients, message = self.connections[0].client.prepare_send(
+            to=to, subject=subject, contents=contents, attachments=attachments
+        )
+        return self.send_raw(recipients, message)
+
+    # Sends an already built message, retrying at once on a fresh connection
+    # when the old one was dropped; any other failure is left to the caller.
+    # Returns how many reconnects the message needed.
+    def send_raw(self, recipients, message):
+        conn = self.idle.get()
+        try:
+            for attempt in range(self.retries + 1):
+                self.throttle()
+                try:
+                    conn.sendmail(recipients, message)
+                    return attempt
+                except RECONNECT_ERRORS:
+                    if attempt == self.retries:
+                        raise
+        finally:
+            self.idle.put(conn)
+
+    def close(self):
+        for conn in self.connections:
+            try:
+                conn.close()
+            except (smtplib.SMTPException, OSError):
+                pass
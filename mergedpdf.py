@@ -0,0 +1,172 @@
+import copy
+import zlib
+from reportlab.lib.rl_accel import fp_str
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.pdfdoc import PDFDocument, PDFName
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfbase.ttfonts import SUBSETN, FF_SYMBOLIC, FF_NONSYMBOLIC, makeToUnicodeCMap
+from fonts import font_name, is_font_file
+
+
+def _escape(data):
+    return data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)').replace(b'\r', b'\\r')
+
+
+# Writes every certificate as a page of one PDF. The background, fonts and page
+# resources are written once at the start and shared by reference from every
+# page, and each page is written out as soon as it is added, so only the object
+# offsets are held in memory however many rows there are.
+class MergedPdfWriter:
+    def __init__(self, output_path, template, layout_cfg):
+        self.template = template
+        self.layout_cfg = layout_cfg
+        self.f = open(output_path, 'wb')
+        self.pos = 0
+        self.offsets = [0]
+        self.page_refs = []
+
+        self.write(b'%PDF-1.4\n%\x93\x8c\x8b\x9e\n')
+        self.catalog_ref = self.reserve()
+        self.pages_ref = self.reserve()
+
+        self.fonts = {}
+        # TrueType fonts by resource name; they are embedded as subsets once every page is written
+        self.ttfonts = {}
+        for field in ('name', 'cert_no'):
+            font = layout_cfg[field]['font']
+            if font not in self.fonts:
+                self.fonts[font] = f"F{len(self.fonts) + 1}"
+                if is_font_file(font):
+                    self.ttfonts[self.fonts[font]] = pdfmetrics.getFont(font_name(font))
+        self.font_refs = {}
+        for font, res_name in self.fonts.items():
+            if res_name not in self.ttfonts:
+                self.font_refs[res_name] = self.add_object(
+                    f"<< /Type /Font /Subtype /Type1 /BaseFont /{font} /Encoding /WinAnsiEncoding >>".encode()
+                )
+
+        xobjects = ''
+        if template._xobject is not None:
+            # Serialise the template's pre-compressed image once for the whole document
+            image = copy.copy(template._xobject).format(PDFDocument(invariant=1))
+            xobjects = f"/XObject << /Bg {self.add_object(image)} 0 R >> "
+        elif template._form is not None:
+            # Copy the imported template form and everything it uses, once
+            form = template._form
+            refs = [self.reserve() for _ in range(len(form))]
+            for i, ref in enumerate(refs):
+                self.add_object(form.body(i, refs.__getitem__), ref)
+            xobjects = f"/XObject << /Bg {refs[0]} 0 R >> "
+
+        # Written at the end, when the font subsets it lists are known
+        self.xobjects = xobjects
+        self.resources_ref = self.reserve()
+
+    def write(self, data):
+        self.f.write(data)
+        self.pos += len(data)
+
+    def reserve(self):
+        self.offsets.append(None)
+        return len(self.offsets) - 1
+
+    def add_object(self, body, ref=None):
+        if ref is None:
+            ref = self.reserve()
+        self.offsets[ref] = self.pos
+        self.write(b'%d 0 obj\n' % ref + body + b'\nendobj\n')
+        return ref
+
+    def add_stream(self, content, entries=b''):
+        return self.add_object(b'<< /Length %d' % len(content) + entries + b' >>\nstream\n' + content + b'\nendstream')
+
+    def text_ops(self, cfg, text):
+        font, size = cfg['font'], cfg['size']
+        x, y = cfg['x'], cfg['y']
+        if cfg.get('align', 'left') == 'center':
+            x -= stringWidth(text, font_name(font), size) / 2
+        r, g, b = (v / 255 for v in cfg['color'])
+        res_name = self.fonts[font]
+        ttf = self.ttfonts.get(res_name)
+        if ttf is None:
+            runs = [(res_name, text.encode('cp1252', 'replace'))]
+        else:
+            # Characters are numbered within subsets of 256 glyphs, each its own font resource
+            runs = [(f"{res_name}S{n}", data) for n, data in ttf.splitString(text, self)]
+        return (
+            f"BT {fp_str(r, g, b)} rg 1 0 0 1 {fp_str(x, y)} Tm ".encode()
+            + b' '.join(f"/{name} {fp_str(size)} Tf (".encode() + _escape(data) + b") Tj" for name, data in runs)
+            + b" ET"
+        )
+
+    # One TrueType font per subset used, each embedding only its own glyphs
+    def add_subset_fonts(self, res_name, ttf):
+        face = ttf.face
+        state = ttf.state.pop(self, None)
+        for n, subset in enumerate(state.subsets if state else []):
+            base_name = PDFName((SUBSETN(n) + b'+' + face.name + face.subfontNameX).decode('pdfdoc')).format(None).encode()
+            font_file = face.makeSubset(subset)
+            font_file_ref = self.add_stream(zlib.compress(font_file),
+                                            b' /Length1 %d /Filter /FlateDecode' % len(font_file))
+            descriptor_ref = self.add_object(
+                b'<< /Type /FontDescriptor /Ascent %s /CapHeight %s /Descent %s /Flags %d /FontBBox [ %s ] /FontName %s'
+                b' /ItalicAngle %s /StemV %s /FontFile2 %d 0 R /MissingWidth %s >>' % (
+                    fp_str(face.ascent).encode(), fp_str(face.capHeight).encode(), fp_str(face.descent).encode(),
+                    (face.flags & ~FF_NONSYMBOLIC) | FF_SYMBOLIC, fp_str(*face.bbox).encode(), base_name,
+                    fp_str(face.italicAngle).encode(), fp_str(face.stemV).encode(), font_file_ref,
+                    fp_str(face.defaultWidth).encode(),
+                )
+            )
+            cmap_ref = self.add_stream(zlib.compress(makeToUnicodeCMap(base_name[1:].decode(), subset).encode()),
+                                       b' /Filter /FlateDecode')
+            self.font_refs[f"{res_name}S{n}"] = self.add_object(
+                b'<< /Type /Font /Subtype /TrueType /BaseFont %s /FirstChar 0 /LastChar %d /Widths [ %s ]'
+                b' /FontDescriptor %d 0 R /ToUnicode %d 0 R >>' % (
+                    base_name, len(subset) - 1, fp_str(*map(face.getCharWidth, subset)).encode(), descriptor_ref,
+                    cmap_ref,
+                )
+            )
+
+    def add_page(self, name, cert_no):
+        width, height = self.template.page_size
+        ops = []
+        if self.template._xobject is not None:
+            ops.append(f"q {fp_str(width)} 0 0 {fp_str(height)} 0 0 cm /Bg Do Q".encode())
+        elif self.template._form is not None:
+            ops.append(self.template._form.draw_op('Bg', self.template.page_size).encode())
+        ops.append(self.text_ops(self.layout_cfg['name'], name))
+        ops.append(self.text_ops(self.layout_cfg['cert_no'], "Certificate No: " + cert_no))
+        contents_ref = self.add_stream(b'\n'.join(ops))
+        self.page_refs.append(self.add_object(
+            f"<< /Type /Page /Parent {self.pages_ref} 0 R /MediaBox [ 0 0 {fp_str(width, height)} ] "
+            f"/Resources {self.resources_ref} 0 R /Contents {contents_ref} 0 R >>".encode()
+        ))
+
+    def close(self):
+        for res_name, ttf in self.ttfonts.items():
+            self.add_subset_fonts(res_name, ttf)
+        fonts = ' '.join(f"/{res_name} {ref} 0 R" for res_name, ref in self.font_refs.items())
+        self.add_object(
+            f"<< {self.xobjects}/Font << {fonts} >> /ProcSet [ /PDF /Text /ImageB /ImageC /ImageI ] >>".encode(),
+            self.resources_ref
+        )
+
+        kids = ' '.join(f"{ref} 0 R" for ref in self.page_refs)
+        self.add_object(f"<< /Type /Pages /Kids [ {kids} ] /Count {len(self.page_refs)} >>".encode(), self.pages_ref)
+        self.add_object(f"<< /Type /Catalog /Pages {self.pages_ref} 0 R >>".encode(), self.catalog_ref)
+
+        xref_pos = self.pos
+        self.write(b'xref\n0 %d\n0000000000 65535 f \n' % len(self.offsets))
+        self.write(b''.join(b'%010d 00000 n \n' % offset for offset in self.offsets[1:]))
+        self.write(
+            b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n'
+            % (len(self.offsets), self.catalog_ref, xref_pos)
+        )
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
@@ -0,0 +1,107 @@
+import json
+import time
+import threading
+import contextlib
+
+STAGES = ('render', 'sign', 'write', 'email')
+
+
+# Time one stage of one row and append the event to `events`. The yielded dict can
+# be filled in with 'bytes' and 'retries'; a raised exception is recorded as a
+# failure and re-raised.
+@contextlib.contextmanager
+def timed(events, stage, cert_no=None):
+    event = {'stage': stage, 'cert_no': cert_no, 'seconds': 0.0, 'bytes': 0, 'retries': 0, 'ok': True}
+    start = time.perf_counter()
+    try:
+        yield event
+    except Exception as e:
+        event['ok'] = False
+        event['error'] = str(e)
+        raise
+    finally:
+        event['seconds'] = round(time.perf_counter() - start, 6)
+        events.append(event)
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))]
+
+
+# Collects stage events from the whole batch, appends each one to a JSON-lines
+# log and keeps per-stage totals for the end-of-run summary. Events may arrive
+# from worker results and delivery threads at the same time.
+class Metrics:
+    def __init__(self, log_path=None):
+        self.lock = threading.Lock()
+        self.run = time.strftime('%Y%m%dT%H%M%S')
+        self.started = time.perf_counter()
+        self.log = open(log_path, 'a', encoding='utf-8') if log_path else None
+        self.seconds = {stage: [] for stage in STAGES}
+        self.bytes = dict.fromkeys(STAGES, 0)
+        self.retries = dict.fromkeys(STAGES, 0)
+        self.failures = dict.fromkeys(STAGES, 0)
+
+    def record(self, event):
+        stage = event['stage']
+        with self.lock:
+            if stage not in self.seconds:
+                self.seconds[stage] = []
+                self.bytes[stage] = self.retries[stage] = self.failures[stage] = 0
+            self.seconds[stage].append(event['seconds'])
+            self.bytes[stage] += event.get('bytes', 0)
+            self.retries[stage] += event.get('retries', 0)
+            if not event.get('ok', True):
+                self.failures[stage] += 1
+            if self.log:
+                self.log.write(json.dumps(dict(event, run=self.run, ts=round(time.time(), 3))) + "\n")
+
+    def extend(self, events):
+        for event in events:
+            self.record(event)
+
+    @contextlib.contextmanager
+    def stage(self, stage, cert_no=None):
+        events = []
+        try:
+            with timed(events, stage, cert_no) as event:
+                yield event
+        finally:
+            self.extend(events)
+
+    def summary(self):
+        rows = []
+        with self.lock:
+            for stage, seconds in self.seconds.items():
+                if not seconds:
+                    continue
+                ordered = sorted(seconds)
+                rows.append({
+                    'stage': stage,
+                    'count': len(seconds),
+                    'failures': self.failures[stage],
+                    'retries': self.retries[stage],
+                    'total_s': round(sum(seconds), 3),
+                    'mean_ms': round(sum(seconds) / len(seconds) * 1000, 2),
+                    'p50_ms': round(percentile(ordered, 50) * 1000, 2),
+                    'p99_ms': round(percentile(ordered, 99) * 1000, 2),
+                    'bytes': self.bytes[stage],
+                })
+        return rows
+
+    def format_summary(self):
+        lines = [f"{'stage':<8}{'count':>8}{'failed':>8}{'retries':>9}{'total s':>10}{'mean ms':>10}"
+                 f"{'p50 ms':>10}{'p99 ms':>10}{'MB':>10}"]
+        for r in self.summary():
+            lines.append(f"{r['stage']:<8}{r['count']:>8}{r['failures']:>8}{r['retries']:>9}{r['total_s']:>10}"
+                         f"{r['mean_ms']:>10}{r['p50_ms']:>10}{r['p99_ms']:>10}{r['bytes'] / 1e6:>10.2f}")
+        lines.append(f"Wall time: {time.perf_counter() - self.started:.2f}s")
+        return "\n".join(lines)
+
+    def close(self):
+        with self.lock:
+            if self.log:
+                self.log.close()
+                self.log = None
@@ -0,0 +1,348 @@
+import os
+import sys
+import time
+import random
+import socket
+import smtplib
+import itertools
+import threading
+import email.policy
+from email.message import EmailMessage
+from email.parser import BytesHeaderParser
+from email.utils import formatdate, make_msgid, getaddresses
+from concurrent.futures import ThreadPoolExecutor
+import click
+from mailer import Mailer, SMTP_HOST, SMTP_PORT, SMTP_SECURITY, SMTP_TIMEOUT
+from metrics import Metrics, timed
+
+OUTBOX_FOLDER = "outbox"
+FOLDERS = ('tmp', 'new', 'cur', 'dead')
+CERT_HEADER = 'X-Certigo-Cert-No'
+MAX_ATTEMPTS = 6
+BACKOFF = 30
+MAX_BACKOFF = 3600
+# A claimed message untouched for this long belongs to a delivery worker that died
+STALE_AFTER = 600
+POLL_INTERVAL = 0.5
+# Seconds a finished batch keeps waiting for a deferred message before leaving it to outbox.py
+LINGER = 60
+THROTTLE_HINTS = ('quota', 'rate limit', 'too many', '4.7.0', '5.4.5')
+
+
+# Fully built message with the certificate attached, ready to hand to any SMTP server
+def build_message(sender, to, subject, body, attachment, cert_no=None):
+    msg = EmailMessage()
+    msg['From'] = sender
+    msg['To'] = to
+    msg['Subject'] = subject
+    msg['Date'] = formatdate(localtime=True)
+    msg['Message-ID'] = make_msgid()
+    if cert_no is not None:
+        msg[CERT_HEADER] = str(cert_no)
+    msg.set_content(body)
+    with open(attachment, 'rb') as f:
+        msg.add_attachment(f.read(), maintype='application', subtype='pdf', filename=os.path.basename(attachment))
+    return msg.as_bytes(policy=email.policy.SMTP)
+
+
+def _parse_name(name):
+    unique, attempts, not_before = name[:-len('.eml')].rsplit(',', 2)
+    return unique, int(attempts), float(not_before)
+
+
+# Maildir-style spool of messages waiting to be sent. Messages are written to
+# tmp/ and renamed into new/, so a reader only ever sees complete files; a
+# delivery worker claims one by renaming it into cur/ and deletes it once sent.
+# Failed messages go back to new/ with their attempt count and the earliest
+# time to retry in the file name (<unique>,<attempts>,<not before>.eml), or to
+# dead/ with a .txt note of the error once retrying is pointless.
+class Outbox:
+    def __init__(self, path):
+        self.path = path
+        for folder in FOLDERS:
+            os.makedirs(os.path.join(path, folder), exist_ok=True)
+        self.seq = itertools.count()
+        self.host = socket.gethostname().replace(os.sep, '_').replace(',', '_').replace(':', '_')
+
+    def _path(self, folder, name):
+        return os.path.join(self.path, folder, name)
+
+    def put(self, message):
+        name = f"{time.time_ns()}.P{os.getpid()}Q{next(self.seq)}.{self.host},0,0.eml"
+        tmp = self._path('tmp', name)
+        with open(tmp, 'wb') as f:
+            f.write(message)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._path('new', name))
+        return name
+
+    # Messages due now, oldest first, and the earliest time a deferred one is due
+    def ready(self):
+        now = time.time()
+        due, next_due = [], None
+        for name in os.listdir(os.path.join(self.path, 'new')):
+            if not name.endswith('.eml'):
+                continue
+            not_before = _parse_name(name)[2]
+            if not_before <= now:
+                due.append(name)
+            elif next_due is None or not_before < next_due:
+                next_due = not_before
+        due.sort()
+        return due, next_due
+
+    # False when another worker claimed it first
+    def claim(self, name):
+        try:
+            os.rename(self._path('new', name), self._path('cur', name))
+        except FileNotFoundError:
+            return False
+        os.utime(self._path('cur', name))
+        return True
+
+    def read(self, name):
+        with open(self._path('cur', name), 'rb') as f:
+            return f.read()
+
+    def done(self, name):
+        os.remove(self._path('cur', name))
+
+    def release(self, name):
+        os.rename(self._path('cur', name), self._path('new', name))
+
+    def defer(self, name, attempts, not_before):
+        unique = _parse_name(name)[0]
+        os.rename(self._path('cur', name), self._path('new', f"{unique},{attempts},{not_before:.0f}.eml"))
+
+    def bury(self, name, error):
+        with open(self._path('dead', name[:-len('.eml')] + '.txt'), 'w', encoding='utf-8') as f:
+            f.write(f"{time.strftime('%Y-%m-%dT%H:%M:%S')} {error}\n")
+        os.rename(self._path('cur', name), self._path('dead', name))
+
+    # Put messages left claimed by a worker that died back in the queue
+    def recover(self, stale_after=STALE_AFTER):
+        cutoff = time.time() - stale_after
+        recovered = 0
+        for name in os.listdir(os.path.join(self.path, 'cur')):
+            try:
+                if os.path.getmtime(self._path('cur', name)) < cutoff:
+                    self.release(name)
+                    recovered += 1
+            except FileNotFoundError:
+                pass
+        return recovered
+
+    # Give dead letters another full set of attempts
+    def requeue_dead(self):
+        requeued = 0
+        for name in os.listdir(os.path.join(self.path, 'dead')):
+            if name.endswith('.eml'):
+                unique = _parse_name(name)[0]
+                os.rename(self._path('dead', name), self._path('new', f"{unique},0,0.eml"))
+                note = self._path('dead', name[:-len('.eml')] + '.txt')
+                if os.path.exists(note):
+                    os.remove(note)
+                requeued += 1
+        return requeued
+
+    def counts(self):
+        return {
+            folder: sum(name.endswith('.eml') for name in os.listdir(os.path.join(self.path, folder)))
+            for folder in ('new', 'cur', 'dead')
+        }
+
+
+# What to do about a failed send: 'fatal' stops delivery altogether (bad login),
+# 'throttle' backs off the whole worker (provider rate or quota limits), 'retry'
+# backs off this message and 'permanent' moves it to the dead letters
+def classify(error):
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        return 'fatal'
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in error.recipients.values()]
+        return 'permanent' if codes and min(codes) >= 500 else 'retry'
+    if isinstance(error, smtplib.SMTPResponseException):
+        text = error.smtp_error.decode(errors='replace') if isinstance(error.smtp_error, bytes) else str(error.smtp_error)
+        if error.smtp_code == 421 or any(hint in text.lower() for hint in THROTTLE_HINTS):
+            return 'throttle'
+        return 'permanent' if error.smtp_code >= 500 else 'retry'
+    if isinstance(error, (smtplib.SMTPException, OSError)):
+        return 'retry'
+    return 'permanent'
+
+
+# Drains an outbox over a Mailer's connections. Each failure is retried with
+# exponential backoff up to max_attempts times; provider throttling pauses every
+# send, and max_per_hour caps the sends in any rolling hour on top of the
+# Mailer's per-second rate.
+class Delivery:
+    def __init__(self, outbox, mailer, concurrency=1, max_attempts=MAX_ATTEMPTS, backoff=BACKOFF, max_backoff=MAX_BACKOFF,
+                 max_per_hour=0, metrics=None, on_sent=None, log=print):
+        self.outbox = outbox
+        self.mailer = mailer
+        self.concurrency = max(1, concurrency)
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_per_hour = max_per_hour
+        self.metrics = metrics
+        self.on_sent = on_sent
+        self.log = log
+        self.lock = threading.Lock()
+        self.recent = []
+        self.paused_until = 0
+        self.cancelled = threading.Event()
+        self.running = threading.Event()
+        self.running.set()
+        self.fatal = None
+        self.sent = self.deferred = self.dead = 0
+
+    def pause(self):
+        self.running.clear()
+
+    def resume(self):
+        self.running.set()
+
+    def cancel(self):
+        self.cancelled.set()
+        self.running.set()
+
+    # Blocks while paused and until throttling and the hourly cap allow another
+    # send; False once cancelled
+    def wait_turn(self):
+        while not self.cancelled.is_set():
+            if not self.running.is_set():
+                self.running.wait()
+                continue
+            with self.lock:
+                now = time.time()
+                wait = self.paused_until - now
+                if self.max_per_hour:
+                    self.recent = [t for t in self.recent if t > now - 3600]
+                    if len(self.recent) >= self.max_per_hour:
+                        wait = max(wait, self.recent[0] + 3600 - now)
+                if wait <= 0:
+                    self.recent.append(now)
+                    return True
+            self.cancelled.wait(min(wait, 5))
+        return False
+
+    def retry_delay(self, attempts):
+        return min(self.max_backoff, self.backoff * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+
+    def deliver(self, name):
+        if self.cancelled.is_set() or not self.outbox.claim(name):
+            return
+        attempts = _parse_name(name)[1]
+        message = self.outbox.read(name)
+        headers = BytesHeaderParser().parsebytes(message)
+        cert_no = headers.get(CERT_HEADER)
+        to = headers.get('To', '')
+        recipients = [addr for _, addr in getaddresses(headers.get_all('To', []) + headers.get_all('Cc', []))]
+        if not self.wait_turn():
+            self.outbox.release(name)
+            return
+
+        events = []
+        try:
+            with timed(events, 'email', cert_no) as event:
+                event['retries'] = attempts
+                event['bytes'] = len(message)
+                event['retries'] += self.mailer.send_raw(recipients, message)
+        except Exception as e:
+            kind = classify(e)
+            # Throttling says nothing about the message, so it doesn't use up an attempt
+            if kind != 'throttle':
+                attempts += 1
+            if kind == 'fatal':
+                self.outbox.release(name)
+                self.fatal = e
+                self.cancel()
+            elif kind == 'permanent' or attempts >= self.max_attempts:
+                self.outbox.bury(name, e)
+                with self.lock:
+                    self.dead += 1
+                self.log(f"❌ Failed to send email to {to}: {e}")
+            else:
+                delay = self.retry_delay(max(1, attempts))
+                if kind == 'throttle':
+                    with self.lock:
+                        self.paused_until = max(self.paused_until, time.time() + delay)
+                self.outbox.defer(name, attempts, time.time() + delay)
+                with self.lock:
+                    self.deferred += 1
+                self.log(f"⏳ Email to {to} failed ({e}), retrying in {delay:.0f}s")
+        else:
+            self.outbox.done(name)
+            with self.lock:
+                self.sent += 1
+            self.log(f"📧 Email sent to {to}")
+            if self.on_sent:
+                self.on_sent(cert_no, to)
+        finally:
+            if self.metrics is not None:
+                self.metrics.extend(events)
+
+    # Send everything that is due. While `generating` is set new messages are
+    # still being spooled, so the outbox is polled until it is cleared; with
+    # wait=True deferred messages are waited for until the outbox is empty.
+    # Otherwise messages due within `linger` seconds are still waited for, so
+    # a brief failure doesn't leave them for a manual outbox.py run.
+    def run(self, generating=None, wait=False, linger=0):
+        self.outbox.recover()
+        with ThreadPoolExecutor(self.concurrency) as executor:
+            while not self.cancelled.is_set():
+                due, next_due = self.outbox.ready()
+                if due:
+                    for _ in executor.map(self.deliver, due):
+                        pass
+                elif generating is not None and generating.is_set():
+                    self.cancelled.wait(POLL_INTERVAL)
+                elif next_due is not None and (wait or next_due - time.time() <= linger):
+                    self.cancelled.wait(max(0, next_due - time.time()) + 0.1)
+                else:
+                    break
+
+    def summary(self):
+        waiting = self.outbox.counts()['new']
+        text = f"📬 {self.sent} email(s) sent, {self.dead} failed"
+        if waiting:
+            text += f", {waiting} waiting for a retry in '{self.outbox.path}' (run outbox.py to send them)"
+        return text
+
+
+@click.command()
+@click.option('--outbox', 'outbox_path', default=os.path.join("certificates", OUTBOX_FOLDER), show_default=True, help='Outbox folder written by certigo.py --email')
+@click.option('--sender', required=True, help='Gmail sender email')
+@click.option('--app-pass', help='Gmail app password')
+@click.option('--smtp-host', default=SMTP_HOST, show_default=True, help='SMTP server host')
+@click.option('--smtp-port', default=SMTP_PORT, show_default=True, help='SMTP server port')
+@click.option('--smtp-security', type=click.Choice(SMTP_SECURITY), default='starttls', show_default=True)
+@click.option('--smtp-timeout', default=SMTP_TIMEOUT, show_default=True, help='Seconds to wait for the SMTP server before giving up on a connection')
+@click.option('--smtp-connections', default=2, show_default=True, help='Number of SMTP connections sending at once')
+@click.option('--max-per-connection', default=100, show_default=True, help='Messages sent before a connection is reopened. 0 for no limit.')
+@click.option('--send-rate', default=0.0, show_default=True, help='Maximum messages per second. 0 for no limit.')
+@click.option('--max-per-hour', default=0, show_default=True, help='Maximum messages in any rolling hour. 0 for no limit.')
+@click.option('--max-attempts', default=MAX_ATTEMPTS, show_default=True, help='Attempts per message before it is moved to the dead letters')
+@click.option('--wait', is_flag=True, help='Keep running until every message is sent or dead, waiting out retry delays')
+@click.option('--requeue-dead', is_flag=True, help='Move the dead letters back into the queue first')
+def main(outbox_path, sender, app_pass, smtp_host, smtp_port, smtp_security, smtp_timeout, smtp_connections, max_per_connection, send_rate,
+         max_per_hour, max_attempts, wait, requeue_dead):
+    outbox = Outbox(outbox_path)
+    if requeue_dead:
+        print(f"↺ {outbox.requeue_dead()} dead letter(s) queued again")
+    metrics = Metrics()
+    with Mailer(sender, app_pass, host=smtp_host, port=smtp_port, security=smtp_security, connections=smtp_connections,
+                max_messages_per_connection=max_per_connection, rate=send_rate, timeout=smtp_timeout) as mailer:
+        delivery = Delivery(outbox, mailer, smtp_connections, max_attempts, max_per_hour=max_per_hour, metrics=metrics)
+        delivery.run(wait=wait)
+    print(delivery.summary())
+    print(metrics.format_summary())
+    if delivery.fatal is not None:
+        raise click.ClickException(f"Delivery stopped: {delivery.fatal}")
+    sys.exit(0 if delivery.dead == 0 else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+import io
+import os
+import re
+import time
+import hashlib
+import tarfile
+import zipfile
+
+LAYOUTS = ('flat', 'prefix', 'hash')
+DEFAULT_SHARD_DIGITS = 3
+ARCHIVE_TYPES = ('.zip', '.tar', '.tar.gz', '.tgz')
+UNSAFE_CHARS = re.compile(r'[^\w-]')
+
+
+# Sub-folder a certificate is written to, relative to the output folder.
+# 'prefix' groups certificates by cert_no without its last `digits` characters,
+# so numbered codes like V25001..V25999 share a folder (V25) of at most 10^digits
+# files; 'hash' spreads any kind of code evenly over 256 folders.
+def shard_folder(cert_no, layout='flat', digits=DEFAULT_SHARD_DIGITS):
+    cert_no = str(cert_no)
+    if layout == 'prefix':
+        return UNSAFE_CHARS.sub('_', cert_no[:max(0, len(cert_no) - digits)]) or '_'
+    if layout == 'hash':
+        return hashlib.sha1(cert_no.encode()).hexdigest()[:2]
+    return ''
+
+
+def is_archive(path):
+    return path.lower().endswith(ARCHIVE_TYPES)
+
+
+# Contents of a certificate recorded as <archive>/<member>, or None when the
+# archive or the member is missing
+def read_archived(path):
+    parts = os.path.normpath(path).split(os.sep)
+    for i in range(len(parts) - 1, 0, -1):
+        archive_path = os.sep.join(parts[:i])
+        if is_archive(archive_path) and os.path.isfile(archive_path):
+            member = '/'.join(parts[i:])
+            try:
+                if archive_path.lower().endswith('.zip'):
+                    with zipfile.ZipFile(archive_path) as zf:
+                        return zf.read(member)
+                with tarfile.open(archive_path) as tf:
+                    return tf.extractfile(member).read()
+            except KeyError:
+                return None
+    return None
+
+
+# Streams finished certificates into one .zip, .tar or .tar.gz as they arrive,
+# so a batch can be handed off without packaging it afterwards. Entries are
+# stored, not deflated: the PDFs' own streams are already compressed.
+# With `fileobj` the archive is written there and `path` only picks the format.
+class ArchiveWriter:
+    def __init__(self, path, fileobj=None):
+        if not is_archive(path):
+            raise ValueError(f"Unsupported archive type '{path}', use one of {', '.join(ARCHIVE_TYPES)}")
+        self.path = path
+        folder = os.path.dirname(path)
+        if folder and fileobj is None:
+            os.makedirs(folder, exist_ok=True)
+        lower = path.lower()
+        if lower.endswith('.zip'):
+            self.zip = zipfile.ZipFile(fileobj or path, 'w', zipfile.ZIP_STORED)
+            self.tar = None
+        else:
+            self.zip = None
+            mode = 'w:gz' if lower.endswith(('.tar.gz', '.tgz')) else 'w'
+            self.tar = tarfile.open(path, mode, fileobj=fileobj) if fileobj is not None else tarfile.open(path, mode)
+
+    def add(self, name, data):
+        # Archive member names always use forward slashes
+        name = name.replace(os.sep, '/')
+        if self.zip is not None:
+            info = zipfile.ZipInfo(name, time.localtime()[:6])
+            info.external_attr = 0o644 << 16
+            self.zip.writestr(info, data)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = time.time()
+            info.mode = 0o644
+            self.tar.addfile(info, io.BytesIO(data))
+
+    def close(self):
+        (self.zip if self.zip is not None else self.tar).close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
@@ -0,0 +1,102 @@
+import io
+from pyhanko.pdf_utils import generic
+from pyhanko.pdf_utils.reader import PdfFileReader
+from pyhanko.pdf_utils.writer import PdfFileWriter
+from reportlab.pdfbase.pdfdoc import PDFObject
+
+
+def _serialize(obj, chunks, found):
+    # Indirect references are left as (idnum, generation) chunks and numbered
+    # later, by whichever document the form ends up in
+    if isinstance(obj, generic.IndirectObject):
+        found.append(obj)
+        chunks.append((obj.idnum, obj.generation))
+    elif isinstance(obj, generic.DictionaryObject):
+        is_stream = isinstance(obj, generic.StreamObject)
+        data = obj.encoded_data if is_stream else None
+        chunks.append(b'<<')
+        for key, value in dict.items(obj):
+            if is_stream and key == '/Length':
+                continue
+            chunks.append(b' /' + key[1:].encode() + b' ')
+            _serialize(value, chunks, found)
+        if is_stream:
+            chunks.append(b' /Length %d >>\nstream\n' % len(data) + data + b'\nendstream')
+        else:
+            chunks.append(b' >>')
+    elif isinstance(obj, generic.ArrayObject):
+        chunks.append(b'[')
+        for i in range(len(obj)):
+            chunks.append(b' ')
+            _serialize(obj.raw_get(i), chunks, found)
+        chunks.append(b' ]')
+    else:
+        buf = io.BytesIO()
+        obj.write_to_stream(buf)
+        chunks.append(buf.getvalue())
+
+
+# A page of a PDF template imported once as a form XObject. The form and every
+# object it uses (fonts, images, patterns) are serialised up front, so each
+# certificate only copies bytes instead of parsing the template again.
+class PdfForm:
+    def __init__(self, path, page_ix=0):
+        with open(path, 'rb') as f:
+            reader = PdfFileReader(io.BytesIO(f.read()), strict=False)
+        writer = PdfFileWriter()
+        form_ref = writer.import_page_as_xobject(reader, page_ix)
+        self.bbox = [float(v) for v in form_ref.get_object()['/BBox']]
+
+        # The form itself is object 0; the rest follow in the order they are reached
+        numbers = {}
+        bodies = []
+        pending = [form_ref]
+        while pending:
+            ref = pending.pop(0)
+            key = (ref.idnum, ref.generation)
+            if key in numbers:
+                continue
+            numbers[key] = len(bodies)
+            chunks = []
+            _serialize(ref.get_object(), chunks, pending)
+            bodies.append(chunks)
+        self.bodies = [
+            [numbers[chunk] if isinstance(chunk, tuple) else chunk for chunk in chunks]
+            for chunks in bodies
+        ]
+
+    def __len__(self):
+        return len(self.bodies)
+
+    # Body of object `index`, with `number(i)` giving the number of object i in the target document
+    def body(self, index, number):
+        return b''.join(
+            b'%d 0 R' % number(chunk) if isinstance(chunk, int) else chunk
+            for chunk in self.bodies[index]
+        )
+
+    # Page content operator that stretches the form over a page of `page_size`
+    def draw_op(self, name, page_size):
+        x0, y0, x1, y1 = self.bbox
+        sx = page_size[0] / (x1 - x0)
+        sy = page_size[1] / (y1 - y0)
+        return f"q {sx:.6g} 0 0 {sy:.6g} {-x0 * sx:.6g} {-y0 * sy:.6g} cm /{name} Do Q"
+
+
+# Name a reportlab document knows object `index` of a form by; the form itself
+# is registered under the XObject name the page resources refer to
+def imported_name(form_name, index):
+    return form_name if index == 0 else f"{form_name}.{index}"
+
+
+# Lets reportlab write one object of a PdfForm, resolving the references
+# between the form's objects through the names they were registered under
+class ImportedObject(PDFObject):
+    def __init__(self, form, index, form_name):
+        self.form = form
+        self.index = index
+        self.form_name = form_name
+
+    def format(self, document):
+        numbers = document.idToObjectNumberAndVersion
+        return self.form.body(self.index, lambda i: numbers[imported_name(self.form_name, i)][0])
@@ -0,0 +1,52 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+_DONE = object()
+
+
+# Put into a bounded queue, giving up once the consumer has gone away
+def _put(q, item, stop):
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+# Run `stage` on the items of `items` in a thread pool while the items themselves
+# are still being produced, so CPU-bound production (rendering, signing) overlaps
+# with I/O-bound delivery. At most `max_pending` items are in flight at once and
+# results are yielded in input order as (item, stage result) pairs.
+def pipelined(items, stage=None, workers=1, max_pending=64):
+    pending = queue.Queue(max(1, max_pending))
+    stop = threading.Event()
+    executor = ThreadPoolExecutor(max(1, workers)) if stage is not None else None
+
+    def produce():
+        try:
+            for item in items:
+                future = executor.submit(stage, item) if executor else None
+                if not _put(pending, (item, future), stop):
+                    return
+        except BaseException as e:
+            _put(pending, (_DONE, e), stop)
+            return
+        _put(pending, (_DONE, None), stop)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item, future = pending.get()
+            if item is _DONE:
+                if future is not None:
+                    raise future
+                break
+            yield item, future.result() if future else None
+    finally:
+        stop.set()
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
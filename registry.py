@@ -0,0 +1,68 @@
+import os
+import sqlite3
+import threading
+import time
+
+FIELDS = ('cert_no', 'name', 'email', 'path', 'sha256', 'signer', 'issued_at')
+
+
+# Permanent index of issued certificates, keyed by cert_no and by the SHA-256 of
+# the issued file, so "is this certificate genuine?" is a single lookup. Unlike
+# the job journal it is never reset; reissuing a cert_no replaces its entry.
+class Registry:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS certificates ("
+            " cert_no TEXT PRIMARY KEY,"
+            " name TEXT NOT NULL,"
+            " email TEXT,"
+            " path TEXT NOT NULL,"
+            " sha256 TEXT,"
+            " signer TEXT,"
+            " issued_at REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS certificates_sha256 ON certificates (sha256)")
+
+    def record(self, cert_no, name, email, path, sha256, signer=None):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO certificates (cert_no, name, email, path, sha256, signer, issued_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (cert_no, name, email, os.path.normpath(path), sha256, signer, time.time())
+            )
+
+    # Merged PDFs are only hashed once the whole file is written. Keyed by the
+    # run's cert_nos: every merged run writes to the same path.
+    def set_hash(self, cert_nos, sha256):
+        with self.lock:
+            self.conn.execute("BEGIN")
+            self.conn.executemany("UPDATE certificates SET sha256 = ? WHERE cert_no = ?",
+                                  ((sha256, cert_no) for cert_no in cert_nos))
+            self.conn.execute("COMMIT")
+
+    def _one(self, where, value):
+        with self.lock:
+            row = self.conn.execute(f"SELECT {', '.join(FIELDS)} FROM certificates WHERE {where} = ?", (value,)).fetchone()
+        return dict(zip(FIELDS, row)) if row else None
+
+    def lookup(self, cert_no):
+        return self._one('cert_no', cert_no)
+
+    def lookup_hash(self, sha256):
+        return self._one('sha256', sha256)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
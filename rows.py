@@ -0,0 +1,112 @@
+import csv
+import os
+from collections import namedtuple
+
+COLUMNS = ('name', 'cert_no', 'email')
+Row = namedtuple('Row', COLUMNS)
+
+
+def _make_row(name, cert_no, email):
+    return Row(str(name).strip(), str(cert_no).strip(), email)
+
+
+def _column_indexes(header, path):
+    header = [str(h).strip() if h is not None else '' for h in header]
+    missing = [c for c in COLUMNS if c not in header]
+    if missing:
+        raise ValueError(f"'{path}' is missing column(s): {', '.join(missing)}")
+    return [header.index(c) for c in COLUMNS]
+
+
+# Read-only mode parses the sheet XML as it goes instead of building the whole workbook
+def _iter_xlsx(path):
+    from openpyxl import load_workbook
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        values = wb.worksheets[0].iter_rows(values_only=True)
+        idx = _column_indexes(next(values, ()), path)
+        for record in values:
+            if all(v is None for v in record):
+                continue
+            yield _make_row(*(record[i] if i < len(record) else None for i in idx))
+    finally:
+        wb.close()
+
+
+def _iter_csv(path):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        idx = _column_indexes(next(reader, ()), path)
+        for record in reader:
+            if not any(record):
+                continue
+            yield _make_row(*(record[i] if i < len(record) else None for i in idx))
+
+
+# pyarrow is only needed for Parquet input, so it is not loaded for anything else
+def _parquet():
+    try:
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Reading Parquet files needs the pyarrow package: pip install pyarrow") from e
+    return pq
+
+
+def _parquet_rows(parquet_file):
+    for batch in parquet_file.iter_batches(columns=list(COLUMNS)):
+        columns = [batch.column(c).to_pylist() for c in COLUMNS]
+        for record in zip(*columns):
+            yield _make_row(*record)
+
+
+# Opens the file straight away, so a missing pyarrow fails before the first row
+def _iter_parquet(path):
+    return _parquet_rows(_parquet().ParquetFile(path))
+
+
+def _iter_other(path):
+    import pandas as pd
+    for record in pd.read_excel(path).itertuples(index=False):
+        record = record._asdict()
+        yield _make_row(*(record[c] for c in COLUMNS))
+
+
+READERS = {
+    '.xlsx': _iter_xlsx,
+    '.xlsm': _iter_xlsx,
+    '.csv': _iter_csv,
+    '.parquet': _iter_parquet,
+}
+
+
+# Stream (name, cert_no, email) rows without loading the whole file
+def iter_rows(path):
+    ext = os.path.splitext(path)[1].lower()
+    return READERS.get(ext, _iter_other)(path)
+
+
+# Cheap row count for progress reporting and chunk sizing. None when it
+# can't be known without reading the whole file.
+def count_rows(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext in ('.xlsx', '.xlsm'):
+        from openpyxl import load_workbook
+        wb = load_workbook(path, read_only=True)
+        try:
+            max_row = wb.worksheets[0].max_row
+        finally:
+            wb.close()
+        return max(0, max_row - 1) if max_row else None
+    if ext == '.csv':
+        lines = 0
+        last = b'\n'
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                lines += chunk.count(b'\n')
+                last = chunk[-1:]
+        if last != b'\n':
+            lines += 1
+        return max(0, lines - 1)
+    if ext == '.parquet':
+        return _parquet().ParquetFile(path).metadata.num_rows
+    return None
@@ -0,0 +1,340 @@
+import io
+import os
+import re
+import json
+import time
+import threading
+import multiprocessing
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import click
+from rows import Row
+from mailer import Mailer, SMTP_HOST, SMTP_PORT, SMTP_SECURITY, SMTP_TIMEOUT
+from metrics import Metrics, timed
+from registry import Registry
+from outbox import Outbox, Delivery, OUTBOX_FOLDER, build_message
+from output import LAYOUTS, DEFAULT_SHARD_DIGITS, ArchiveWriter
+from background import CACHE_DIR, DEFAULT_DPI
+from fonts import register_fonts
+from certigo import (
+    CERT_FOLDER, METRICS_FILE, REGISTRY_FILE, CertificateTemplate, render_row, signing_session, prepare_background,
+    certificate_email_body, _init_worker, _render_row_in_worker
+)
+
+DEFAULT_PORT = 8765
+MAX_BODY = 10 * 1024 * 1024
+MAX_BATCH = 1000
+# How long a request waits for a free slot before it is turned away with 503
+QUEUE_TIMEOUT = 30
+CERT_NO_PATTERN = re.compile(r'^[\w-][\w.-]{0,99}$')
+UNSAFE_NAME = re.compile(r'[/\\\x00-\x1f]')
+
+
+class BadRequest(Exception):
+    pass
+
+
+def parse_row(item):
+    if not isinstance(item, dict):
+        raise BadRequest("each certificate must be an object with name, cert_no and email")
+    name = str(item.get('name') or '').strip()
+    cert_no = str(item.get('cert_no') or '').strip()
+    email = str(item.get('email') or '').strip() or None
+    # Both end up in the file name
+    if not name or len(name) > 200 or UNSAFE_NAME.search(name):
+        raise BadRequest(f"invalid name {name!r}")
+    if not CERT_NO_PATTERN.match(cert_no):
+        raise BadRequest(f"invalid cert_no {cert_no!r}")
+    return Row(name, cert_no, email)
+
+
+# Everything a certificate needs, loaded once when the service starts: the
+# layout config, the decoded background, the signing key and, with workers,
+# a pool of processes that each hold their own warm copies.
+class IssuanceService:
+    def __init__(self, bg_image, paper_size, orientation, layout_cfg, output_folder=CERT_FOLDER, sign_args=None,
+                 workers=1, max_concurrent=None, layout='flat', mailer=None, sender=None, quiet=False, bg_dpi=0):
+        os.makedirs(output_folder, exist_ok=True)
+        bg_image, _ = prepare_background(bg_image, paper_size, orientation, layout_cfg, bg_dpi,
+                                         cache_dir=os.path.join(output_folder, CACHE_DIR))
+        self.layout_cfg = layout_cfg
+        self.output_folder = output_folder
+        self.layout = layout
+        self.quiet = quiet
+        # Loaded here even with workers, so a bad key or password fails before the pool starts
+        signing = signing_session(sign_args)
+        self.signer = signing.fingerprint if signing else None
+        self.metrics = Metrics(os.path.join(output_folder, METRICS_FILE))
+        self.registry = Registry(os.path.join(output_folder, REGISTRY_FILE))
+        self.slots = threading.BoundedSemaphore(max_concurrent or workers)
+        self.started = time.time()
+        self.workers = workers
+
+        if workers > 1:
+            self.pool = multiprocessing.Pool(
+                workers,
+                initializer=_init_worker,
+                initargs=(bg_image, paper_size, orientation, layout_cfg, output_folder, sign_args, None, False, False,
+                          layout, DEFAULT_SHARD_DIGITS, True)
+            )
+            self.template = self.signing = None
+        else:
+            self.pool = None
+            self.template = CertificateTemplate(bg_image, paper_size, orientation)
+            self.signing = signing
+
+        self.sender = sender
+        self.delivery = None
+        if mailer is not None:
+            self.outbox = Outbox(os.path.join(output_folder, OUTBOX_FOLDER))
+            self.delivery = Delivery(self.outbox, mailer, len(mailer.connections), metrics=self.metrics,
+                                     log=self.log)
+            self.running = threading.Event()
+            self.running.set()
+            self.delivery_thread = threading.Thread(target=self.delivery.run, args=(self.running,), daemon=True)
+            self.delivery_thread.start()
+
+    def log(self, message):
+        if not self.quiet:
+            print(message, flush=True)
+
+    def render(self, rows):
+        if self.pool is not None:
+            return self.pool.map(_render_row_in_worker, rows, chunksize=max(1, len(rows) // (self.workers * 4)))
+        return [
+            render_row(row, self.template, self.layout_cfg, self.output_folder, self.signing, layout=self.layout,
+                       archive=True)
+            for row in rows
+        ]
+
+    # Render, sign and keep a copy of each certificate, and queue its email when asked.
+    # Returns the RowResults, with the PDF in `data` and `path` relative to the output folder.
+    def issue(self, rows, send=False):
+        if send:
+            if self.delivery is None:
+                raise BadRequest("this service was started without email delivery")
+            if not all(row.email for row in rows):
+                raise BadRequest("every certificate needs an email to be sent")
+        results = self.render(rows)
+        for result in results:
+            self.metrics.extend(result.events)
+            final_path = os.path.join(self.output_folder, result.path)
+            with self.metrics.stage('write', result.cert_no) as event:
+                os.makedirs(os.path.dirname(final_path), exist_ok=True)
+                with open(final_path, 'wb') as f:
+                    f.write(result.data)
+                event['bytes'] = len(result.data)
+            self.registry.record(result.cert_no, result.name, result.email, final_path, result.sha256, self.signer)
+            if send:
+                self.outbox.put(build_message(self.sender, result.email, "Your Certificate",
+                                              certificate_email_body(result.name, result.cert_no), final_path,
+                                              result.cert_no))
+            self.log(f"✔ Certificate for {result.name} (Code: {result.cert_no}) issued{', email queued' if send else ''}.")
+        return results
+
+    def status(self):
+        return {
+            'status': 'ok',
+            'uptime_s': round(time.time() - self.started, 1),
+            'workers': self.workers,
+            'signing': self.signer is not None,
+            'email': self.delivery is not None,
+        }
+
+    def close(self):
+        if self.delivery is not None:
+            self.running.clear()
+            self.delivery_thread.join()
+            self.delivery.mailer.close()
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+        self.metrics.close()
+        self.registry.close()
+
+
+# POST /certificate  {"name", "cert_no", "email", "send": false} -> the signed PDF
+#                    with "send": true the email is queued and 202 with JSON is returned
+# POST /batch        {"certificates": [...], "send": false} -> ZIP of the PDFs, or 202 with JSON
+# GET  /health       service status
+# GET  /metrics      per-stage counts and latency percentiles
+class IssuanceHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'certigo'
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status, payload, headers=None):
+        self.send_body(status, json.dumps(payload).encode(), 'application/json', headers)
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY:
+            # The body is left unread, so the connection can't be reused
+            self.close_connection = True
+            raise BadRequest(f"request body over {MAX_BODY} bytes")
+        try:
+            payload = json.loads(self.rfile.read(length) or b'null')
+        except ValueError:
+            raise BadRequest("request body is not valid JSON")
+        if not isinstance(payload, dict):
+            raise BadRequest("request body must be a JSON object")
+        return payload
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(200, self.service.status())
+        elif self.path == '/metrics':
+            self.send_json(200, self.service.metrics.summary())
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        handlers = {'/certificate': self.post_certificate, '/batch': self.post_batch}
+        if self.path not in handlers:
+            self.send_json(404, {'error': 'not found'})
+            return
+        try:
+            payload = self.read_json()
+        except BadRequest as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        if not self.service.slots.acquire(timeout=QUEUE_TIMEOUT):
+            self.send_json(503, {'error': 'too many requests in progress'}, {'Retry-After': '1'})
+            return
+        events = []
+        try:
+            with timed(events, 'request') as event:
+                event['bytes'] = handlers[self.path](payload)
+        except BadRequest as e:
+            self.send_json(400, {'error': str(e)})
+        except Exception as e:
+            self.send_json(500, {'error': str(e)})
+        finally:
+            self.service.slots.release()
+            self.service.metrics.extend(events)
+
+    def post_certificate(self, payload):
+        send = bool(payload.get('send'))
+        result = self.service.issue([parse_row(payload)], send)[0]
+        if send:
+            self.send_json(202, self.describe(result, send))
+            return 0
+        self.send_body(200, result.data, 'application/pdf', {
+            'Content-Disposition': f'attachment; filename="{os.path.basename(result.path)}"',
+            'X-Certificate-Sha256': result.sha256,
+        })
+        return len(result.data)
+
+    def post_batch(self, payload):
+        items = payload.get('certificates')
+        if not isinstance(items, list) or not items:
+            raise BadRequest("certificates must be a non-empty list")
+        if len(items) > MAX_BATCH:
+            raise BadRequest(f"at most {MAX_BATCH} certificates per batch")
+        send = bool(payload.get('send'))
+        results = self.service.issue([parse_row(item) for item in items], send)
+        if send:
+            self.send_json(202, {'certificates': [self.describe(result, send) for result in results]})
+            return 0
+        buf = io.BytesIO()
+        with ArchiveWriter('certificates.zip', buf) as archive:
+            for result in results:
+                archive.add(result.path, result.data)
+        body = buf.getvalue()
+        self.send_body(200, body, 'application/zip', {'Content-Disposition': 'attachment; filename="certificates.zip"'})
+        return len(body)
+
+    def describe(self, result, send):
+        return {'cert_no': result.cert_no, 'path': result.path.replace(os.sep, '/'), 'sha256': result.sha256,
+                'queued': send}
+
+
+def make_server(service, host='127.0.0.1', port=DEFAULT_PORT):
+    server = ThreadingHTTPServer((host, port), IssuanceHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+@click.command()
+@click.option('--host', default='127.0.0.1', show_default=True, help='Address to listen on. Keep it local unless a proxy in front handles authentication.')
+@click.option('--port', default=DEFAULT_PORT, show_default=True)
+@click.option('--bg-image', default='template.png', show_default=True, help='Background PNG/JPG image, or a PDF whose first page is used')
+@click.option('--config', default='config.json', show_default=True, help='JSON file with font/position/color settings')
+@click.option('--orientation', type=click.Choice(['portrait', 'landscape']), default='landscape')
+@click.option('--paper-size', type=click.Choice(['A4', 'LETTER']), default='A4')
+@click.option('--bg-dpi', default=0, show_default=True, help=f'Resample the background to this resolution at the printed page size, e.g. {DEFAULT_DPI} for certificates only shown on screen. 0 embeds it unchanged.')
+@click.option('--output', 'output_folder', default=CERT_FOLDER, show_default=True, help='Folder issued certificates are kept in')
+@click.option('--layout', type=click.Choice(LAYOUTS), default='flat', show_default=True, help='Folder layout of the issued certificates')
+@click.option('--sign/--no-sign', default=False)
+@click.option('--cert', default='cert.pem')
+@click.option('--key', default='key.pem')
+@click.option('--password', default='password', help='Password for the private key. If not set, Default password is password.')
+@click.option('--signature-field', default='Signature1', show_default=True)
+@click.option('--workers', default=1, show_default=True, help='Worker processes rendering and signing. 0 uses every CPU core.')
+@click.option('--max-concurrent', type=int, help='Requests handled at once; the rest wait for a slot. Defaults to the number of workers.')
+@click.option('--sender', help='Gmail sender email. Enables "send": true.')
+@click.option('--app-pass', help='Gmail app password')
+@click.option('--smtp-host', default=SMTP_HOST, show_default=True)
+@click.option('--smtp-port', default=SMTP_PORT, show_default=True)
+@click.option('--smtp-security', type=click.Choice(SMTP_SECURITY), default='starttls', show_default=True)
+@click.option('--smtp-timeout', default=SMTP_TIMEOUT, show_default=True)
+@click.option('--smtp-connections', default=2, show_default=True)
+@click.option('--send-rate', default=0.0, show_default=True, help='Maximum messages per second. 0 for no limit.')
+@click.option('--quiet', is_flag=True, help="Don't print a line per issued certificate")
+def main(host, port, bg_image, config, orientation, paper_size, bg_dpi, output_folder, layout, sign, cert, key, password,
+         signature_field, workers, max_concurrent, sender, app_pass, smtp_host, smtp_port, smtp_security,
+         smtp_timeout, smtp_connections, send_rate, quiet):
+    with open(config) as f:
+        layout_cfg = json.load(f)
+    try:
+        # Parsed once here and inherited by the workers
+        register_fonts(layout_cfg)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--config')
+    mailer = Mailer(sender, app_pass, host=smtp_host, port=smtp_port, security=smtp_security,
+                    connections=smtp_connections, rate=send_rate, timeout=smtp_timeout) if sender else None
+    try:
+        service = IssuanceService(
+            bg_image, paper_size, orientation, layout_cfg,
+            output_folder=output_folder,
+            sign_args=(cert, key, password, signature_field) if sign else None,
+            workers=workers or os.cpu_count(),
+            max_concurrent=max_concurrent,
+            layout=layout,
+            mailer=mailer,
+            sender=sender,
+            quiet=quiet,
+            bg_dpi=bg_dpi
+        )
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    server = make_server(service, host, port)
+    print(f"🚀 Issuing certificates on http://{host}:{server.server_address[1]} (Ctrl+C to stop)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        print(service.metrics.format_summary())
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    main()
@@ -0,0 +1,78 @@
+import io
+import asyncio
+import functools
+from pyhanko.sign import signers, sign_pdf
+from pyhanko.pdf_utils.incremental_writer import IncrementalPdfFileWriter
+from pyhanko.keys import load_cert_from_pemder, load_private_key_from_pemder
+from pyhanko.sign.general import get_pyca_cryptography_hash
+from pyhanko_certvalidator.registry import SimpleCertificateStore
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.ec import ECDSA
+from cryptography.hazmat.primitives.asymmetric.padding import PKCS1v15
+
+# SimpleSigner parses the private key again for every signature, which for RSA
+# also re-runs the expensive key consistency checks. Parse it once and keep it.
+class CachedKeySigner(signers.SimpleSigner):
+    @functools.cached_property
+    def private_key(self):
+        return serialization.load_der_private_key(self.signing_key.dump(), password=None)
+
+    def sign_raw(self, data, digest_algorithm):
+        try:
+            mechanism = self.get_signature_mechanism_for_digest(digest_algorithm).signature_algo
+        except ValueError:
+            return super().sign_raw(data, digest_algorithm)
+        if mechanism == 'rsassa_pkcs1v15':
+            return self.private_key.sign(data, PKCS1v15(), get_pyca_cryptography_hash(digest_algorithm))
+        if mechanism == 'ecdsa':
+            return self.private_key.sign(data, ECDSA(get_pyca_cryptography_hash(digest_algorithm)))
+        if mechanism == 'ed25519':
+            return self.private_key.sign(data)
+        return super().sign_raw(data, digest_algorithm)
+
+# Signing session, loads the certificate and decrypts the key once for many PDFs.
+# Create one per process; the signer holds key material that is not shared.
+class SigningSession:
+    def __init__(self, cert_path, key_path, password, field_name="Signature1"):
+        try:
+            signing_key = load_private_key_from_pemder(key_path, passphrase=password.encode())
+            signing_cert = load_cert_from_pemder(cert_path)
+        except (OSError, ValueError, TypeError) as e:
+            raise ValueError(f"Could not load signing certificate '{cert_path}' or key '{key_path}': {e}")
+        self.signer = CachedKeySigner(
+            signing_cert=signing_cert,
+            signing_key=signing_key,
+            cert_registry=SimpleCertificateStore()
+        )
+        self.signature_meta = signers.PdfSignatureMetadata(field_name=field_name)
+        self.fingerprint = signing_cert.sha256.hex()
+        self.bytes_reserved = self.estimate_bytes_reserved()
+
+    # pyHanko sizes the signature placeholder with a dry-run signature on every
+    # document unless told otherwise, so work it out once for the session.
+    def estimate_bytes_reserved(self):
+        test_cms = asyncio.run(self.signer.async_sign(bytes(64), 'sha512', dry_run=True))
+        # Hex encoding doubles the size, plus the same 50% margin pyHanko uses
+        test_len = len(test_cms.dump()) * 2
+        return test_len + 2 * (test_len // 4)
+
+    def sign_stream(self, inf, outf):
+        w = IncrementalPdfFileWriter(inf)
+        sign_pdf(
+            w,
+            signature_meta=self.signature_meta,
+            signer=self.signer,
+            existing_fields_only=False,
+            bytes_reserved=self.bytes_reserved,
+            output=outf
+        )
+
+    def sign_bytes(self, pdf_bytes):
+        out = io.BytesIO()
+        self.sign_stream(io.BytesIO(pdf_bytes), out)
+        return out.getvalue()
+
+    def sign_to_path(self, pdf_path, signed_path):
+        with open(pdf_path, 'rb') as inf, open(signed_path, 'w+b') as outf:
+            self.sign_stream(inf, outf)
+        return signed_path
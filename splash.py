@@ -1,18 +1,49 @@
+import time
+STARTED = time.perf_counter()
+
 from PyQt5.QtWidgets import QApplication, QSplashScreen
 from PyQt5.QtGui import QPixmap
 from PyQt5.QtCore import Qt, QTimer
+import os
 import sys
-import certigo_gui
+import json
+
+# With --measure-startup the app quits as soon as the window is up and reports
+# how long that took, appending it to CERTIGO_STARTUP_LOG when that is set
+MEASURE = '--measure-startup' in sys.argv
 
 app = QApplication(sys.argv)
 splash_pix = QPixmap("icon.png")
 splash = QSplashScreen(splash_pix, Qt.WindowStaysOnTopHint)
 splash.show()
+app.processEvents()
+
+# Load main GUI while the splash is showing and close it once the window is ready
+import certigo_gui
+window = certigo_gui.CertigoGUI()
+window.show()
+splash.finish(window)
+
+
+def report_startup():
+    seconds = time.perf_counter() - STARTED
+    record = {
+        'seconds': round(seconds, 3),
+        'frozen': getattr(sys, 'frozen', False),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    # Windowed builds have no console to print to
+    if sys.stdout is not None:
+        print(json.dumps(record), flush=True)
+    log_path = os.environ.get('CERTIGO_STARTUP_LOG')
+    if log_path:
+        with open(log_path, 'a') as f:
+            f.write(json.dumps(record) + "\n")
+    app.quit()
+
 
-# Load main GUI after delay
-QTimer.singleShot(2000, lambda: (
-    splash.close(),
-    certigo_gui.CertigoGUI().show()
-))
+if MEASURE:
+    # Runs once the event loop has processed the first paint
+    QTimer.singleShot(0, report_startup)
 
 sys.exit(app.exec_())
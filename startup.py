@@ -0,0 +1,71 @@
+import os
+import sys
+import json
+import time
+import shlex
+import statistics
+import subprocess
+import click
+from gitinfo import git_commit
+
+DEFAULT_COMMANDS = (
+    f"{shlex.quote(sys.executable)} certigo.py --help",
+    f"{shlex.quote(sys.executable)} splash.py --measure-startup",
+)
+
+
+# Wall time of a whole process, from launch to exit, so interpreter start-up and
+# PyInstaller unpacking count too. Commands that print a JSON line with
+# 'seconds' (splash.py --measure-startup) also report their in-process time.
+def time_command(command):
+    start = time.perf_counter()
+    proc = subprocess.run(shlex.split(command), capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise click.ClickException(f"'{command}' exited with {proc.returncode}:\n{proc.stderr.strip()}")
+    in_process = None
+    for line in proc.stdout.splitlines():
+        try:
+            in_process = json.loads(line)['seconds']
+        except (ValueError, KeyError, TypeError):
+            pass
+    return wall, in_process
+
+
+@click.command()
+@click.option('--command', 'commands', multiple=True, help='Command to time; repeat for several. Defaults to the CLI help and the GUI start-up.')
+@click.option('--runs', default=5, show_default=True, help='Launches per command; the first is a warm-up and not counted')
+@click.option('--output', help='Where to save the JSON results. Defaults to bench_results/startup-<time>-<commit>.json')
+def main(commands, runs, output):
+    results = []
+    for command in commands or DEFAULT_COMMANDS:
+        print(f"⏱ {command} ...", flush=True)
+        time_command(command)
+        samples = [time_command(command) for _ in range(runs)]
+        walls = [wall for wall, _ in samples]
+        in_process = [s for _, s in samples if s is not None]
+        results.append({
+            'command': command,
+            'runs': runs,
+            'median_s': round(statistics.median(walls), 3),
+            'min_s': round(min(walls), 3),
+            'max_s': round(max(walls), 3),
+            'in_process_median_s': round(statistics.median(in_process), 3) if in_process else None,
+        })
+
+    commit = git_commit()
+    if not output:
+        os.makedirs("bench_results", exist_ok=True)
+        output = os.path.join("bench_results", f"startup-{time.strftime('%Y%m%d-%H%M%S')}-{commit or 'nogit'}.json")
+    with open(output, 'w') as f:
+        json.dump({'commit': commit, 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results}, f, indent=2)
+
+    print()
+    print(f"{'median s':>9}{'min s':>8}{'max s':>8}{'in-app s':>10}  command")
+    for r in results:
+        print(f"{r['median_s']:>9}{r['min_s']:>8}{r['max_s']:>8}{str(r['in_process_median_s']):>10}  {r['command']}")
+    print(f"\nResults saved to {output}")
+
+
+if __name__ == '__main__':
+    main()
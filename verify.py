@@ -0,0 +1,147 @@
+import os
+import sys
+import hashlib
+import logging
+import multiprocessing
+import click
+from registry import Registry
+from certigo import CERT_FOLDER, REGISTRY_FILE, file_sha256
+from output import read_archived
+
+# Worker processes load the trust roots and open the registry once, in the pool initializer
+_worker_state = {}
+
+
+def _init_worker(trust_paths, registry_path):
+    # Failures are reported per file; pyHanko's own tracebacks would drown them
+    logging.getLogger('pyhanko').setLevel(logging.CRITICAL)
+    logging.getLogger('pyhanko_certvalidator').setLevel(logging.CRITICAL)
+    from pyhanko.keys import load_cert_from_pemder
+    _worker_state['trust'] = [load_cert_from_pemder(p) for p in trust_paths]
+    _worker_state['registry'] = Registry(registry_path) if registry_path and os.path.exists(registry_path) else None
+
+
+# Check one PDF: is its last signature intact and covering the whole file, is the
+# signer trusted (when trust roots were given) and was this exact file issued by us
+def check_file(path):
+    from pyhanko.pdf_utils.reader import PdfFileReader
+    from pyhanko.sign.validation import validate_pdf_signature
+    from pyhanko.sign.validation.status import SignatureCoverageLevel
+    from pyhanko_certvalidator import ValidationContext
+
+    trust = _worker_state['trust']
+    registry = _worker_state['registry']
+    result = {'path': path, 'signed': False, 'intact': False, 'trusted': None, 'signer': None, 'cert_no': None, 'error': None}
+    try:
+        sha256 = file_sha256(path)
+        entry = registry.lookup_hash(sha256) if registry else None
+        result['cert_no'] = entry['cert_no'] if entry else None
+        with open(path, 'rb') as f:
+            signatures = PdfFileReader(f, strict=False).embedded_signatures
+            if signatures:
+                result['signed'] = True
+                status = validate_pdf_signature(
+                    signatures[-1], ValidationContext(trust_roots=trust) if trust else None
+                )
+                result['intact'] = bool(status.intact and status.valid and status.coverage == SignatureCoverageLevel.ENTIRE_FILE)
+                result['trusted'] = bool(status.trusted) if trust else None
+                result['signer'] = status.signing_cert.sha256.hex()
+    except Exception as e:
+        result['error'] = str(e)
+    return result
+
+
+def problems(result, allow_unsigned=False):
+    if result['error']:
+        return [result['error']]
+    found = []
+    if not result['signed']:
+        if not allow_unsigned:
+            found.append("not signed")
+    elif not result['intact']:
+        found.append("signature broken or does not cover the whole file")
+    if result['trusted'] is False:
+        found.append("signer not trusted")
+    if result['cert_no'] is None:
+        found.append("not in the registry (modified or not issued here)")
+    return found
+
+
+def iter_pdfs(folder):
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        for file in sorted(files):
+            if file.lower().endswith('.pdf'):
+                yield os.path.join(root, file)
+
+
+# Hash of an issued file, which may sit inside an archive written with --archive
+def issued_sha256(path):
+    if os.path.exists(path):
+        return file_sha256(path)
+    data = read_archived(path)
+    return hashlib.sha256(data).hexdigest() if data is not None else None
+
+
+# Look certificates up by cert_no and check the issued file is still what was recorded
+def lookup(registry, cert_nos):
+    ok = True
+    for cert_no in cert_nos:
+        entry = registry.lookup(cert_no)
+        if entry is None:
+            print(f"❌ {cert_no}: no certificate with this number was issued")
+            ok = False
+            continue
+        print(f"✔ {cert_no}: issued to {entry['name']} <{entry['email'] or '-'}>")
+        print(f"   file:   {entry['path']}")
+        print(f"   sha256: {entry['sha256'] or '-'}")
+        print(f"   signer: {entry['signer'] or 'unsigned'}")
+        sha256 = issued_sha256(entry['path'])
+        if sha256 is None:
+            print("   ⚠ issued file is missing")
+        elif entry['sha256'] and sha256 != entry['sha256']:
+            print("   ❌ issued file has been modified since it was issued")
+            ok = False
+    return ok
+
+
+@click.command()
+@click.argument('cert_nos', nargs=-1)
+@click.option('--registry', 'registry_path', help=f'Registry written by certigo.py. Defaults to {REGISTRY_FILE} in the {CERT_FOLDER} folder.')
+@click.option('--folder', type=click.Path(exists=True, file_okay=False), help='Check the signature of every PDF in this folder and below')
+@click.option('--trust', 'trust_paths', multiple=True, type=click.Path(exists=True), help='Certificate (.pem) to trust as a signer; repeat for several')
+@click.option('--allow-unsigned', is_flag=True, help='Accept registered PDFs that carry no signature')
+@click.option('--workers', default=0, show_default=True, help='Worker processes for --folder. 0 uses every CPU core.')
+def main(cert_nos, registry_path, folder, trust_paths, allow_unsigned, workers):
+    if not cert_nos and not folder:
+        raise click.UsageError("Give one or more certificate numbers, or --folder")
+    registry_path = registry_path or os.path.join(CERT_FOLDER, REGISTRY_FILE)
+
+    ok = True
+    if cert_nos:
+        if not os.path.exists(registry_path):
+            raise click.ClickException(f"No registry at '{registry_path}'")
+        with Registry(registry_path) as registry:
+            ok = lookup(registry, cert_nos)
+
+    if folder:
+        workers = workers or os.cpu_count()
+        checked = passed = 0
+        with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(trust_paths, registry_path)) as pool:
+            for result in pool.imap_unordered(check_file, iter_pdfs(folder), chunksize=8):
+                found = problems(result, allow_unsigned)
+                if found:
+                    print(f"❌ {result['path']}: {', '.join(found)}")
+                else:
+                    print(f"✔ {result['path']}: genuine, certificate {result['cert_no']}")
+                    passed += 1
+                checked += 1
+        print(f"\n{passed} of {checked} PDF(s) verified as genuine.")
+        ok = ok and passed == checked
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    main()